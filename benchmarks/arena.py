@@ -0,0 +1,180 @@
+# Self-play arena for the Connect 4 AI: plays engine configurations against each other in
+# parallel worker processes and reports win/draw/loss, Elo estimates and CPU time per move.
+#
+#   python -m benchmarks.arena depth=4 time=0.05 engine=mcts,time=0.05 --games 200 --workers 4
+#
+# An engine is given as comma-separated key=value settings: engine (alphabeta, the default, or
+# mcts), depth (maximum search depth), time (seconds per move), nodes (node budget per move),
+# endgame (empty cells from which positions are solved exactly instead of searched),
+# eval (0 to score alpha-beta leaves as draws instead of using the evaluation function),
+# rollout (heuristic, the default, or random MCTS playouts), or the word random for a random
+# mover.
+# Every pairing plays each randomised opening twice with colours swapped.
+import argparse
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cogs import connect4
+from utils.engines import MCTSEngine, SearchBudget
+
+def parse_engine(spec):
+    # "depth=4,time=0.1" -> {"depth": 4, "time": 0.1}
+    if spec == "random":
+        return {"random": True}
+    config = {}
+    for part in spec.split(","):
+        key, _, value = part.partition("=")
+        if key not in ("engine", "depth", "time", "nodes", "endgame", "eval", "rollout"):
+            raise ValueError(f"unknown engine setting {key!r} in {spec!r}")
+        if key in ("engine", "rollout"):
+            config[key] = value
+        else:
+            config[key] = float(value) if key == "time" else int(value)
+    return config
+
+def make_engine(config, seed):
+    # Fresh engine for one side of a game, or None for the random mover
+    if config.get("random"):
+        return None
+    if config.get("engine", "alphabeta") == "mcts":
+        rules = connect4.Connect4Rules(heuristic=config.get("rollout", "heuristic") != "random")
+        return MCTSEngine(rules, seed=seed)
+    return connect4.AlphaBetaEngine(heuristic=bool(config.get("eval", 1)))
+
+def random_opening(rng, plies, geometry):
+    # Random moves that neither end the game nor leave a win in one for the side to move
+    while True:
+        board = connect4.create_board(geometry)
+        moves = []
+        for ply in range(plies):
+            col = rng.choice(connect4.get_valid_moves(board))
+            connect4.make_move(board, col, ply % 2)
+            moves.append(col)
+        if connect4.is_terminal_node(board):
+            continue
+        red, yellow = board.bitboards
+        occupied = red | yellow
+        playable = (occupied + geometry.bottom_mask) & geometry.board_mask
+        if not connect4.winning_cells(board.bitboards[plies % 2], occupied, geometry) & playable:
+            return moves
+
+def choose_move(config, engine, board, player, rng):
+    if engine is None:
+        return rng.choice(connect4.get_valid_moves(board)), 0
+    budget = SearchBudget(config.get("time"), config.get("nodes"), config.get("depth"))
+    result, _ = connect4.endgame_search(engine, board, player, budget, config.get("endgame", 0))
+    return result.move, result.nodes
+
+def play_game(configs, opening, seed, size=connect4.STANDARD.name):
+    # Play one game, configs[0] moving first after the opening. Returns (score of configs[0]
+    # as 1/0.5/0, [cpu seconds, moves, nodes] for each engine)
+    rng = random.Random(seed)
+    board = connect4.create_board(connect4.VARIANTS[size])
+    for ply, col in enumerate(opening):
+        connect4.make_move(board, col, ply % 2)
+    engines = [make_engine(configs[0], seed), make_engine(configs[1], seed + 1)]
+    stats = [[0.0, 0, 0], [0.0, 0, 0]]
+    # The opening may have an odd number of plies, so map side to move onto engines
+    first = len(opening) % 2
+    while True:
+        player = board.moves % 2
+        engine = 0 if player == first else 1
+        start = time.process_time()
+        col, nodes = choose_move(configs[engine], engines[engine], board, player, rng)
+        stats[engine][0] += time.process_time() - start
+        stats[engine][1] += 1
+        stats[engine][2] += nodes
+        connect4.make_move(board, col, player)
+        if connect4.check_winner(board, player):
+            return (1.0 if engine == 0 else 0.0), stats
+        if board.moves == board.geometry.cells:
+            return 0.5, stats
+
+def elo_difference(score, games):
+    # Elo difference implied by a score fraction, with a 95% margin from the normal approximation
+    fraction = min(max(score / games, 0.5 / games), 1 - 0.5 / games)
+    elo = -400 * math.log10(1 / fraction - 1)
+    margin = 1.96 * math.sqrt(fraction * (1 - fraction) / games) * 400 / (math.log(10) * fraction * (1 - fraction))
+    return elo, margin
+
+def fit_ratings(names, results, iterations=200):
+    # Bradley-Terry ratings over all pairings, the first engine anchored at 0
+    ratings = {name: 0.0 for name in names}
+    for _ in range(iterations):
+        for name in names[1:]:
+            expected = actual = 0.0
+            for (a, b), (score, games) in results.items():
+                if name not in (a, b):
+                    continue
+                other = b if name == a else a
+                own_score = score if name == a else games - score
+                expected += games / (1 + 10 ** ((ratings[other] - ratings[name]) / 400))
+                actual += own_score
+            if expected:
+                ratings[name] += 32 * (actual - expected) / max(expected, 1)
+    return ratings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play Connect 4 engine configurations against each other.")
+    parser.add_argument("engines", nargs="+", help="engine specs, e.g. depth=4 time=0.05 random")
+    parser.add_argument("--games", type=int, default=100, help="games per pairing, an even number")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random plies before the engines play")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--size", choices=connect4.VARIANTS, default=connect4.STANDARD.name, help="board size, columns x rows")
+    args = parser.parse_args(argv)
+    if len(args.engines) < 2:
+        parser.error("at least two engines are needed")
+    if args.games < 2 or args.games % 2:
+        # Every opening is played twice, once with each engine moving first
+        parser.error("--games must be a positive even number")
+
+    configs = {spec: parse_engine(spec) for spec in args.engines}
+    rng = random.Random(args.seed)
+    jobs = []
+    for a, b in itertools.combinations(args.engines, 2):
+        for game in range(0, args.games, 2):
+            opening = random_opening(rng, args.opening_plies, connect4.VARIANTS[args.size])
+            seed = rng.getrandbits(32)
+            jobs.append(((a, b), (configs[a], configs[b]), opening, seed))
+            jobs.append(((b, a), (configs[b], configs[a]), opening, seed))
+
+    results = {pair: [0.0, 0, 0, 0, 0] for pair in itertools.combinations(args.engines, 2)}  # score, W, D, L, games
+    usage = {spec: [0.0, 0, 0] for spec in args.engines}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [(names, executor.submit(play_game, engine_configs, opening, seed, args.size)) for names, engine_configs, opening, seed in jobs]
+        for (first, second), future in futures:
+            score, stats = future.result()
+            for name, engine_stats in zip((first, second), stats):
+                for i in range(3):
+                    usage[name][i] += engine_stats[i]
+            # Record from the point of view of the pairing's first engine
+            pair = (first, second) if (first, second) in results else (second, first)
+            own = score if pair[0] == first else 1 - score
+            entry = results[pair]
+            entry[0] += own
+            entry[1 if own == 1 else 2 if own == 0.5 else 3] += 1
+            entry[4] += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(jobs)} games in {elapsed:.1f}s on {args.workers} worker(s)\n")
+    print(f"{'pairing':<44} {'W':>5} {'D':>5} {'L':>5} {'Elo diff':>16}")
+    for (a, b), (score, wins, draws, losses, games) in results.items():
+        elo, margin = elo_difference(score, games)
+        print(f"{a + ' vs ' + b:<44} {wins:>5} {draws:>5} {losses:>5} {elo:>+8.0f} ± {margin:<5.0f}")
+
+    ratings = fit_ratings(args.engines, {pair: (entry[0], entry[4]) for pair, entry in results.items()})
+    print(f"\n{'engine':<24} {'Elo':>6} {'cpu/move':>10} {'nodes/move':>12}")
+    for name in sorted(args.engines, key=lambda name: -ratings[name]):
+        cpu, moves, nodes = usage[name]
+        print(f"{name:<24} {ratings[name]:>+6.0f} {cpu / max(moves, 1) * 1000:>8.1f}ms {nodes / max(moves, 1):>12.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# Offline check of cluster mode: starts the cluster launcher with real worker processes running
+# main.py against the stand-in gateway in benchmarks.fake_gateway, then checks that
+#
+#   - every shard is online exactly once, on the cluster shard_ranges assigns it to;
+#   - a killed worker is restarted and its shards come back, while other clusters stay online;
+#   - a rolling restart never has more than one cluster offline at a time;
+#   - the IPC stats reach the launcher from every worker.
+#
+#   python -m benchmarks.cluster --shards 8 --clusters 3
+#
+# Exits with status 1 when a check fails.
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+
+from benchmarks.fake_gateway import StandInGateway
+from utils import cluster
+
+def clusters_offline(gateway, since):
+    # Largest number of clusters that had shards offline at the same time after `since`
+    offline, worst = {}, 0
+    for at, state, shard_id, cluster_id in gateway.events:
+        if state == "offline":
+            offline[shard_id] = cluster_id
+        else:
+            offline.pop(shard_id, None)
+        if at >= since:
+            worst = max(worst, len(set(offline.values())))
+    return worst
+
+async def run(args):
+    failures = []
+    def check(ok, message):
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    gateway = StandInGateway(args.shards)
+    await gateway.start()
+    directory = tempfile.mkdtemp(prefix="cluster-check-")
+    env = dict(os.environ)
+    env.update({
+        "STAND_IN_GATEWAY": str(gateway.port),
+        "AI_WORKERS": "0",
+        "SESSIONS_FILE": os.path.join(directory, "sessions.json"),
+        "COMMAND_HASH_FILE": os.path.join(directory, ".command_hash"),
+        "GAME_LOG_DIR": os.path.join(directory, "games"),
+    })
+    env.pop("METRICS_PORT", None)
+    env.pop("METRICS_LOG_INTERVAL", None)
+    launcher = cluster.ClusterLauncher(args.shards, args.clusters, env=env)
+    loop = asyncio.get_running_loop()
+
+    try:
+        # Assignment
+        start = loop.time()
+        await launcher.start()
+        ranges = cluster.shard_ranges(args.shards, args.clusters)
+        expected = {shard_id: cluster_id for cluster_id, shard_ids in enumerate(ranges) for shard_id in shard_ids}
+        check(gateway.online == expected, f"{args.shards} shards online on the expected {len(ranges)} clusters "
+                                          f"after {loop.time() - start:.1f}s")
+        check(gateway.conflicts == 0, f"no shard identified twice ({gateway.conflicts} conflicts)")
+
+        # Stats over IPC; every worker sends its first report as soon as it connects
+        totals = launcher.totals()
+        check(totals.get("shards") == args.shards and totals.get("clusters_ready") == len(ranges),
+              f"cluster totals reported over IPC: {totals}")
+
+        # Failover
+        victim = launcher.workers[-1]
+        others = set(expected) - set(victim.shard_ids)
+        since = loop.time()
+        victim.process.send_signal(signal.SIGKILL)
+        try:
+            await gateway.wait_for(lambda: not set(victim.shard_ids) & set(gateway.online), args.timeout)
+            await gateway.wait_for(lambda: gateway.online == expected, args.timeout)
+            check(True, f"killed cluster {victim.cluster_id} restarted and back online in {loop.time() - since:.1f}s")
+        except asyncio.TimeoutError:
+            check(False, f"killed cluster {victim.cluster_id} back online within {args.timeout:.0f}s")
+        dropped = {shard_id for at, state, shard_id, _ in gateway.events if at >= since and state == "offline"} & others
+        check(not dropped, f"other clusters stayed online during failover (dropped {sorted(dropped)})")
+
+        # Rolling restart
+        since = loop.time()
+        await launcher.rolling_restart()
+        restarted = {cluster_id for at, state, _, cluster_id in gateway.events if at >= since and state == "offline"}
+        check(restarted == set(range(len(ranges))) and gateway.online == expected,
+              f"rolling restart cycled every cluster in {loop.time() - since:.1f}s")
+        check(loop.time() - since < cluster.STOP_TIMEOUT, "workers stopped on request instead of being killed")
+        worst = clusters_offline(gateway, since)
+        check(worst <= 1, f"at most one cluster offline during the rolling restart (worst {worst})")
+        check(gateway.conflicts == 0, f"no shard identified twice ({gateway.conflicts} conflicts)")
+    finally:
+        await launcher.close()
+        gateway.close()
+    return 1 if failures else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check cluster mode against a local stand-in gateway.")
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--clusters", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds allowed for a worker to come back")
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Local stand-ins for the parts of discord.Interaction the game cogs use, so the real session
+# callbacks can run without a gateway connection. Every REST call sleeps for a simulated latency
+# and goes through a per-channel bucket that raises HTTP 429 once it is exhausted.
+import asyncio
+import datetime
+import itertools
+import random
+
+import discord
+
+_snowflakes = itertools.count(1)
+
+class FakeUser:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+        self.mention = f"<@{user_id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class _RateLimitedResponse:
+    # Minimal aiohttp-like response accepted by discord.HTTPException
+    status = 429
+    reason = "Too Many Requests"
+
+class FakeDiscord:
+    # Simulated REST side: latency per call and a fixed-window rate limit per channel bucket
+    def __init__(self, latency=0.05, jitter=0.02, bucket_size=5, bucket_window=5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket_size = bucket_size
+        self.bucket_window = bucket_window
+        self.buckets = {}
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def request(self, channel_id, per_channel=True):
+        loop = asyncio.get_running_loop()
+        self.calls += 1
+        if per_channel and self.bucket_size:
+            window_start, used = self.buckets.get(channel_id, (loop.time(), 0))
+            if loop.time() - window_start >= self.bucket_window:
+                window_start, used = loop.time(), 0
+            if used >= self.bucket_size:
+                self.rate_limited += 1
+                error = discord.HTTPException(_RateLimitedResponse(), "You are being rate limited.")
+                error.retry_after = self.bucket_window - (loop.time() - window_start)
+                raise error
+            self.buckets[channel_id] = (window_start, used + 1)
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+
+class FakeInteractionResponse:
+    # Interaction callbacks are not bucketed per channel, like Discord's acknowledgement route
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def _respond(self, **fields):
+        if self.done:
+            raise discord.InteractionResponded(self.interaction)
+        self.done = True
+        await self.interaction.discord.request(self.interaction.channel_id, per_channel=False)
+        self.interaction.apply(fields)
+
+    async def send_message(self, content=None, **fields):
+        await self._respond(content=content, **fields)
+        if self.interaction.message is None:
+            self.interaction.message = FakeMessage(next(_snowflakes))
+
+    async def edit_message(self, **fields):
+        await self._respond(**fields)
+
+    async def defer(self, **kwargs):
+        await self._respond()
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **fields):
+        await self.interaction.discord.request(self.interaction.channel_id)
+
+class FakeInteraction:
+    def __init__(self, client, discord_api, user, channel_id, message=None, custom_id=None, guild_id=None, values=None):
+        self.id = next(_snowflakes)
+        self.client = client
+        self.discord = discord_api
+        self.user = user
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.message = message
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        if custom_id is None:
+            self.type = discord.InteractionType.application_command
+            self.data = {}
+        else:
+            self.type = discord.InteractionType.component
+            if values is None:
+                self.data = {"custom_id": custom_id, "component_type": 2}
+            else:
+                # Select menu pick
+                self.data = {"custom_id": custom_id, "component_type": 3, "values": values}
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        # Last rendered state of the message, for inspection
+        self.rendered = {}
+        self.edits = 0
+
+    def apply(self, fields):
+        self.edits += 1
+        self.rendered.update({key: value for key, value in fields.items() if value is not None})
+
+    async def edit_original_response(self, **fields):
+        await self.discord.request(self.channel_id)
+        self.apply(fields)
+
+    async def original_response(self):
+        return self.message
+
+class FakeClient:
+    # Carries the services main.py attaches to the bot
+    def __init__(self, user, **services):
+        self.user = user
+        for name, service in services.items():
+            setattr(self, name, service)
+
+    def add_listener(self, func, name=None):
+        pass
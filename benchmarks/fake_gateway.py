@@ -0,0 +1,64 @@
+# Local stand-in for Discord's gateway, used to check cluster mode without Discord. Workers
+# started with STAND_IN_GATEWAY=<port> identify their shards here over one connection each
+# (utils.cluster.connect_stand_in), and the shards count as online until that connection closes.
+# Like the real gateway it refuses shards outside the shard count and a shard that is already
+# online, which would mean two clusters were given the same shard.
+import asyncio
+import json
+
+from utils.cluster import send
+
+class StandInGateway:
+    def __init__(self, shard_count):
+        self.shard_count = shard_count
+        self.server = None
+        self.port = None
+        # Shard id -> cluster id of the connection it is online on
+        self.online = {}
+        # (loop time, "online" or "offline", shard id, cluster id) for every change
+        self.events = []
+        self.conflicts = 0
+        self.changed = asyncio.Event()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def close(self):
+        self.server.close()
+
+    def record(self, state, shard_id, cluster_id):
+        self.events.append((asyncio.get_running_loop().time(), state, shard_id, cluster_id))
+        self.changed.set()
+
+    async def handle(self, reader, writer):
+        shards = []
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                shard_id, cluster_id = message["shard"], message.get("cluster")
+                if message.get("shard_count") != self.shard_count or not 0 <= shard_id < self.shard_count:
+                    await send(writer, {"op": "invalid", "shard": shard_id, "reason": "shard out of range"})
+                elif shard_id in self.online:
+                    self.conflicts += 1
+                    await send(writer, {"op": "invalid", "shard": shard_id, "reason": "shard already online"})
+                else:
+                    self.online[shard_id] = cluster_id
+                    shards.append(shard_id)
+                    self.record("online", shard_id, cluster_id)
+                    await send(writer, {"op": "ready", "shard": shard_id})
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for shard_id in shards:
+                self.record("offline", shard_id, self.online.pop(shard_id))
+            writer.close()
+
+    async def wait_for(self, predicate, timeout):
+        # Wait until predicate() holds after some change, or raise asyncio.TimeoutError
+        async def wait():
+            while not predicate():
+                self.changed.clear()
+                await self.changed.wait()
+        await asyncio.wait_for(wait(), timeout)
@@ -0,0 +1,181 @@
+# Headless load generator: plays many concurrent games through the real cogs and session callbacks
+# against the fake Discord in benchmarks.fake_discord.
+#
+#   python -m benchmarks.load --games 2000 --concurrency 500 --mode mixed
+#
+# Reports games per second, p50/p99 turn latency (button press until the last edit it caused was
+# delivered), event loop stalls, REST calls and rate limits, and traced memory per running game.
+import argparse
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+
+from cogs import connect4, tictactoe
+from benchmarks.fake_discord import FakeClient, FakeDiscord, FakeInteraction, FakeUser
+from benchmarks.run import percentile
+from utils.ai_scheduler import AIScheduler
+from utils.ai_service import AIService
+from utils.board_images import BoardRenderer
+from utils.message_editor import MessageEditor
+from utils.sessions import SessionRegistry
+
+BOT_USER = FakeUser(0, "Miini-Games")
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.discord = FakeDiscord(args.latency, args.jitter, args.bucket_size, args.bucket_window)
+        self.ai_service = AIService(workers=args.workers)
+        self.client = FakeClient(
+            BOT_USER, ai_service=self.ai_service, ai_scheduler=AIScheduler(self.ai_service), message_editor=MessageEditor(),
+            sessions=SessionRegistry(), board_renderer=BoardRenderer()
+        )
+        self.cogs = {"connect4": connect4.Connect4(self.client), "tictactoe": tictactoe.TicTacToe(self.client)}
+        self.turn_latencies = []
+        self.games_finished = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.next_user_id = 1
+
+    def new_user(self):
+        self.next_user_id += 1
+        return FakeUser(self.next_user_id, f"player{self.next_user_id}")
+
+    async def start_game(self, game, channel_id, player1, opponent):
+        cog = self.cogs[game]
+        interaction = FakeInteraction(self.client, self.discord, player1, channel_id, guild_id=channel_id % self.args.guilds)
+        size = self.args.connect4_size if game == "connect4" else self.args.tictactoe_size
+        await type(cog).play.callback(cog, interaction, opponent, size=size, display=self.args.display)
+        # Every generated player starts exactly one game
+        session = next(
+            session for session in self.client.sessions.sessions.values() if session.player_ids[0] == player1.id
+        )
+        return session, interaction.message
+
+    def choose_actions(self, session):
+        # Component presses making one random move, as (action, selected values) pairs
+        if isinstance(session, connect4.Connect4Session):
+            return [(str(random.choice(connect4.get_valid_moves(session.board))), None)]
+        size = len(session.board)
+        empty = [(row, col) for row in range(size) for col in range(size) if session.board[row][col] == 0]
+        row, col = random.choice(empty)
+        if session.uses_selects():
+            return [("row", [str(row)]), ("col", [str(col)])]
+        return [(f"{row}{col}", None)]
+
+    async def play_game(self, index):
+        game = self.args.game if self.args.game != "both" else random.choice(["connect4", "tictactoe"])
+        vs_ai = self.args.mode == "ai" or (self.args.mode == "mixed" and index % 2 == 0)
+        players = {}
+        player1 = self.new_user()
+        players[player1.id] = player1
+        opponent = None
+        if not vs_ai:
+            opponent = self.new_user()
+            players[opponent.id] = opponent
+
+        session, message = await self.start_game(game, index, player1, opponent)
+        registry = self.client.sessions
+        while session.game_id in registry.sessions:
+            await asyncio.sleep(random.uniform(0, self.args.think_time))
+            user = players[session.player_ids[session.current]]
+            for action, values in self.choose_actions(session):
+                interaction = FakeInteraction(
+                    self.client, self.discord, user, index, message, session.custom_id(action),
+                    guild_id=index % self.args.guilds, values=values
+                )
+                start = time.perf_counter()
+                await registry.dispatch(interaction)
+                await self.client.message_editor.flush(interaction)
+                self.turn_latencies.append(time.perf_counter() - start)
+        self.games_finished += 1
+
+    async def monitor_loop(self, interval=0.05, stall=0.1):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = loop.time() - start - interval
+            self.max_lag = max(self.max_lag, lag)
+            if lag > stall:
+                self.stalls += 1
+
+    async def run(self):
+        self.ai_service.start()
+        monitor = asyncio.create_task(self.monitor_loop(stall=self.args.stall))
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(index):
+            async with semaphore:
+                await self.play_game(index)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(index) for index in range(self.args.games)))
+        elapsed = time.perf_counter() - start
+        monitor.cancel()
+        self.ai_service.shutdown()
+        return elapsed
+
+async def measure_memory(args, games=1000):
+    # Traced memory held per running game, measured on games that have just started
+    generator = LoadGenerator(args)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for index in range(games):
+        game = args.game if args.game != "both" else ("connect4", "tictactoe")[index % 2]
+        await generator.start_game(game, index, generator.new_user(), None)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    generator.client.sessions.stop()
+    return used / games
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many concurrent games against a fake Discord.")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=250, help="games running at the same time")
+    parser.add_argument("--game", choices=["connect4", "tictactoe", "both"], default="both")
+    parser.add_argument("--mode", choices=["ai", "human", "mixed"], default="mixed")
+    parser.add_argument("--ai-budget", type=float, default=0.05, help="AI seconds per move on boards that need a search")
+    parser.add_argument("--connect4-size", choices=connect4.VARIANTS, default=connect4.STANDARD.name)
+    parser.add_argument("--tictactoe-size", choices=tictactoe.VARIANTS, default="3x3")
+    parser.add_argument("--display", choices=["text", "image"], default="text", help="board rendering mode")
+    parser.add_argument("--guilds", type=int, default=50, help="guilds the games are spread over")
+    parser.add_argument("--workers", type=int, default=0, help="AI worker processes, 0 runs searches in a thread")
+    parser.add_argument("--think-time", type=float, default=0.05, help="maximum simulated human delay per move")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per REST call")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--bucket-size", type=int, default=5, help="REST calls per channel per window, 0 disables")
+    parser.add_argument("--bucket-window", type=float, default=5.0)
+    parser.add_argument("--stall", type=float, default=0.1, help="event loop lag counted as a stall")
+    args = parser.parse_args(argv)
+
+    connect4.DIFFICULTIES["normal"] = connect4.DIFFICULTIES["normal"]._replace(time=args.ai_budget)
+    tictactoe.AI_TIME_BUDGETS["normal"] = args.ai_budget
+    # Every game has its own channel, so keep the render hold short of the simulated AI budget
+    connect4.AI_RENDER_HOLD = min(connect4.AI_RENDER_HOLD, args.ai_budget * 4)
+    tictactoe.AI_RENDER_HOLD = min(tictactoe.AI_RENDER_HOLD, args.ai_budget * 4)
+
+    async def run():
+        per_game = await measure_memory(args)
+        generator = LoadGenerator(args)
+        elapsed = await generator.run()
+        generator.client.sessions.stop()
+        generator.client.board_renderer.shutdown()
+        return generator, elapsed, per_game
+
+    generator, elapsed, per_game = asyncio.run(run())
+    latencies = generator.turn_latencies
+    print(f"games              {generator.games_finished} in {elapsed:.2f}s ({generator.games_finished / elapsed:.1f} games/s)")
+    print(f"turns              {len(latencies)}")
+    if latencies:
+        print(f"turn latency       p50 {percentile(latencies, 0.5) * 1000:.1f}ms  p99 {percentile(latencies, 0.99) * 1000:.1f}ms")
+    print(f"event loop         {generator.stalls} stalls over {args.stall * 1000:.0f}ms, max lag {generator.max_lag * 1000:.1f}ms")
+    print(f"REST calls         {generator.discord.calls} ({generator.discord.calls / max(generator.games_finished, 1):.1f}/game), "
+          f"{generator.discord.rate_limited} rate limited")
+    print(f"memory per game    {per_game / 1024:.1f}KiB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
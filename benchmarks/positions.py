@@ -0,0 +1,28 @@
+# Fixed Connect 4 corpus for the benchmarks, as 1-based column sequences played from an empty board
+CONNECT4_POSITIONS = {
+    "opening": [
+        "4",
+        "4453",
+        "354122",
+    ],
+    "middlegame": [
+        "42547224141556",
+        "5112251472221526",
+        "722535712341114751",
+    ],
+    "endgame": [
+        "5634722513632121537267363655",
+        "73571654245246171427711514257563",
+        "1731721166632337451756655163227352",
+    ],
+}
+
+# Tic-Tac-Toe positions as 9-character strings, row by row: x = cross, o = circle, . = empty
+TICTACTOE_POSITIONS = [
+    ".........",
+    "x........",
+    "....x....",
+    "x...o...x",
+    "xo..x...o",
+    "xoxox....",
+]
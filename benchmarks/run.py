@@ -0,0 +1,234 @@
+# Reproducible benchmarks for the game engines and board rendering.
+#
+#   python -m benchmarks.run --output results.json
+#   python -m benchmarks.run --compare baseline.json --threshold 0.10
+#
+# Every benchmark reports latency percentiles, operations per second, peak traced memory and,
+# for searches, nodes per second. With --compare the run fails when a benchmark's median latency
+# is more than --threshold slower than in the baseline file. Board image renders always fail the
+# run when their p99 is over the frame budget of utils.board_images.
+import argparse
+import itertools
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from cogs import connect4, tictactoe
+from utils import board_images
+from benchmarks.positions import CONNECT4_POSITIONS, TICTACTOE_POSITIONS
+
+def connect4_position(sequence, geometry=connect4.STANDARD):
+    board = connect4.create_board(geometry)
+    for i, char in enumerate(sequence):
+        connect4.make_move(board, int(char) - 1, i % 2)
+    return board, len(sequence) % 2
+
+def tictactoe_position(cells):
+    board = tictactoe.create_board()
+    for index, char in enumerate(cells):
+        board[index // 3][index % 3] = {"x": 1, "o": 2}.get(char, 0)
+    return board
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+def measure(name, fn, min_time, batch=1):
+    # Time fn() in batches until min_time has passed; fn returns the nodes it searched, or None
+    fn()
+    samples, nodes, elapsed = [], 0, 0.0
+    while elapsed < min_time or len(samples) < 5:
+        start = time.perf_counter()
+        for _ in range(batch):
+            searched = fn()
+        duration = time.perf_counter() - start
+        samples.append(duration / batch)
+        elapsed += duration
+        nodes += (searched or 0) * batch
+
+    # Peak memory is taken on a separate call so tracing does not skew the timings
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    calls = len(samples) * batch
+    result = {
+        "name": name,
+        "calls": calls,
+        "mean": elapsed / calls,
+        "p50": percentile(samples, 0.50),
+        "p90": percentile(samples, 0.90),
+        "p99": percentile(samples, 0.99),
+        "ops_per_sec": calls / elapsed,
+        "peak_memory": peak,
+    }
+    if nodes:
+        result["nodes_per_sec"] = nodes / elapsed
+    return result
+
+def minimax_benchmark(positions, depth):
+    # Search of every position to a fixed depth, returning the nodes visited. Built by a function
+    # of its own so each benchmark binds its own positions and depth, not those of the last loop
+    # iteration.
+    def search():
+        nodes = 0
+        for board, player in positions:
+            budget = connect4.SearchBudget()
+            connect4.minimax(board, depth, -math.inf, math.inf, True, player, None, budget)
+            nodes += budget.nodes
+        return nodes
+    return search
+
+def connect4_benchmarks(depths):
+    # Yield (name, fn, batch) for every Connect 4 benchmark
+    for phase, sequences in CONNECT4_POSITIONS.items():
+        positions = [connect4_position(sequence) for sequence in sequences]
+        for depth in depths:
+            yield f"connect4.minimax[{phase},depth={depth}]", minimax_benchmark(positions, depth), 1
+
+    # The same openings on the larger variants, to keep an eye on how search cost grows with the board
+    for name, geometry in connect4.VARIANTS.items():
+        if geometry is connect4.STANDARD:
+            continue
+        positions = [connect4_position(sequence, geometry) for sequence in CONNECT4_POSITIONS["opening"]]
+        for depth in depths:
+            yield f"connect4.minimax[opening,{name},depth={depth}]", minimax_benchmark(positions, depth), 1
+
+    # Exact solves of the endgame positions, each starting from an empty solver table
+    positions = [connect4_position(sequence) for sequence in CONNECT4_POSITIONS["endgame"]]
+    def solve(positions=positions):
+        nodes = 0
+        solver = connect4.EndgameSolver()
+        for board, player in positions:
+            solver.reset()
+            nodes += solver.search(board, player, connect4.SearchBudget()).nodes
+        return nodes
+    yield "connect4.endgame_solver[endgame]", solve, 1
+
+    boards = [connect4_position(sequence)[0] for sequences in CONNECT4_POSITIONS.values() for sequence in sequences]
+    def check_winner():
+        for board in boards:
+            connect4.check_winner(board, connect4.RED)
+            connect4.check_winner(board, connect4.YELLOW)
+    yield "connect4.check_winner", check_winner, 100
+
+    def evaluate():
+        for board in boards:
+            connect4.evaluate(board, connect4.RED)
+    yield "connect4.evaluate", evaluate, 10
+
+    def evaluate_children():
+        for board in boards:
+            connect4.evaluate_children(board, connect4.get_valid_moves(board), connect4.RED)
+    yield "connect4.evaluate_children", evaluate_children, 10
+
+    def board_to_string():
+        for board in boards:
+            connect4.board_to_string(board, 3)
+    yield "connect4.board_to_string", board_to_string, 100
+
+def tictactoe_benchmarks():
+    # Yield (name, fn, batch) for every Tic-Tac-Toe benchmark
+    boards = [tictactoe_position(cells) for cells in TICTACTOE_POSITIONS]
+    def find_best_move():
+        for board in boards:
+            tictactoe.find_best_move(board)
+    yield "tictactoe.find_best_move", find_best_move, 100
+
+    def evaluate():
+        for board in boards:
+            tictactoe.evaluate(board)
+    yield "tictactoe.evaluate", evaluate, 100
+
+def render_benchmarks():
+    # Yield (name, fn, batch) for the board images, one cache-missing frame per call
+    renderer = board_images.BoardRenderer(workers=1)
+    renderer.get_atlas()
+    for name, geometry in connect4.VARIANTS.items():
+        grids = []
+        for sequences in CONNECT4_POSITIONS.values():
+            for sequence in sequences:
+                board, _ = connect4_position(sequence, geometry)
+                grids.append(connect4.board_to_grid(board, int(sequence[-1]) - 1 if sequence else None))
+        def render(frames=itertools.cycle(grids)):
+            renderer.render_sync(next(frames))
+        yield f"render.connect4[{name}]", render, 1
+
+    rng = random.Random(0)
+    grids = []
+    for moves in (10, 30, 60):
+        board = tictactoe.create_board(9)
+        for index in rng.sample(range(81), moves):
+            board[index // 9][index % 9] = 1 + index % 2
+        grids.append(tictactoe.board_to_grid(board))
+    def render(frames=itertools.cycle(grids)):
+        renderer.render_sync(next(frames))
+    yield "render.tictactoe[9x9]", render, 1
+
+def compare(results, baseline, threshold):
+    # Return the benchmarks whose median latency regressed by more than threshold
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result["name"])
+        if old is None:
+            continue
+        change = result["p50"] / old["p50"] - 1
+        status = "REGRESSION" if change > threshold else "ok"
+        print(f"{result['name']:<48} {old['p50'] * 1e6:>12.1f}us -> {result['p50'] * 1e6:>12.1f}us  {change:+7.1%}  {status}")
+        if change > threshold:
+            regressions.append(result["name"])
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the game engines and board rendering.")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed median slowdown, default 0.10")
+    parser.add_argument("--depths", type=int, nargs="+", default=[2, 4, 6], help="Connect 4 search depths")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to run each benchmark")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    benchmarks = [*connect4_benchmarks(args.depths), *tictactoe_benchmarks(), *render_benchmarks()]
+    results = []
+    for name, fn, batch in benchmarks:
+        if args.filter not in name:
+            continue
+        result = measure(name, fn, args.min_time, batch)
+        results.append(result)
+        nodes = f"  {result['nodes_per_sec']:>12,.0f} nodes/s" if "nodes_per_sec" in result else ""
+        print(f"{result['name']:<48} p50 {result['p50'] * 1e6:>10.1f}us  p99 {result['p99'] * 1e6:>10.1f}us  "
+              f"peak {result['peak_memory'] / 1024:>8.1f}KiB{nodes}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "timestamp": time.time(),
+                "results": results,
+            }, f, indent=2)
+
+    over_budget = [result["name"] for result in results
+                   if result["name"].startswith("render.") and result["p99"] > board_images.FRAME_BUDGET]
+    if over_budget:
+        print(f"{len(over_budget)} render(s) over the {board_images.FRAME_BUDGET * 1e3:.0f}ms frame budget: {', '.join(over_budget)}")
+        return 1
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
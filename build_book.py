@@ -0,0 +1,91 @@
+# Opening book builder for the Connect 4 AI: deep-searches every position the bot can face in its
+# first moves and writes the moves found to a book that the AI workers memory-map at runtime, so
+# those positions are answered without searching.
+#
+#   python build_book.py --plies 8 --time 2
+#   python build_book.py --size 8x7 --plies 6 --depth 12
+#
+# The bot plays yellow, so by default the book follows every red move but only the book's own
+# yellow replies; --player both covers every line for both sides, at a much higher cost. A
+# position and its mirror image share one record. Books are written to OPENING_BOOK_DIR (default
+# books) as connect4-<size>.book, where the bot looks for them; restart the bot after a rebuild.
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv, find_dotenv
+
+from cogs import connect4
+from utils.opening_book import write_book
+
+load_dotenv(find_dotenv())
+
+def search_position(payload, player, depth, time_budget):
+    # Book move of one position, searched in a worker process without consulting any book
+    return connect4.search_move(payload, player, "alphabeta", depth, 0, None, time_budget).move
+
+def build(geometry, plies, players, depth, time_budget, workers):
+    # {book key: move} of every position with at most plies pieces reachable when the sides in
+    # players only play their book moves
+    records = {}
+    layer = [connect4.create_board(geometry)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for ply in range(plies + 1):
+            player = ply % 2
+            start = time.perf_counter()
+            if player in players:
+                futures = [executor.submit(search_position, board.to_payload(), player, depth, time_budget) for board in layer]
+                moves = []
+                for board, future in zip(layer, futures):
+                    col = future.result()
+                    key, mirrored = connect4.book_key(board)
+                    records[key] = geometry.columns - 1 - col if mirrored else col
+                    moves.append([col])
+                print(f"ply {ply}: searched {len(layer)} position(s) in {time.perf_counter() - start:.1f}s")
+            else:
+                moves = [connect4.get_valid_moves(board) for board in layer]
+            if ply == plies:
+                break
+
+            # Positions after the moves, one of each mirrored pair, leaving out finished games
+            children, seen = [], set()
+            for board, cols in zip(layer, moves):
+                for col in cols:
+                    child = board.copy()
+                    connect4.make_move(child, col, player)
+                    if connect4.check_winner(child, player) or child.moves == geometry.cells:
+                        continue
+                    key = connect4.book_key(child)[0]
+                    if key not in seen:
+                        seen.add(key)
+                        children.append(child)
+            layer = children
+    return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the Connect 4 opening book.")
+    parser.add_argument("--size", choices=connect4.VARIANTS, default=connect4.STANDARD.name, help="board size, columns x rows")
+    parser.add_argument("--plies", type=int, default=8, help="deepest position stored, in pieces on the board")
+    parser.add_argument("--player", choices=["yellow", "red", "both"], default="yellow", help="side the book plays")
+    parser.add_argument("--time", type=float, default=2.0, help="search seconds per position")
+    parser.add_argument("--depth", type=int, help="maximum search depth per position")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="book file, default connect4-<size>.book in OPENING_BOOK_DIR")
+    args = parser.parse_args(argv)
+
+    geometry = connect4.VARIANTS[args.size]
+    players = {"red": (connect4.RED,), "yellow": (connect4.YELLOW,), "both": (connect4.RED, connect4.YELLOW)}[args.player]
+    output = args.output or connect4.book_path(os.getenv('OPENING_BOOK_DIR', 'books'), geometry)
+    start = time.perf_counter()
+    records = build(geometry, args.plies, players, args.depth, args.time, args.workers)
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    key_bytes = (geometry.columns * geometry.height + 7) // 8
+    write_book(output, f"c4:{geometry.name}", {key: bytes([col]) for key, col in records.items()}, key_bytes, 1, args.plies)
+    print(f"Wrote {len(records)} position(s) to {output} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
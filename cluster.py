@@ -0,0 +1,74 @@
+# Cluster launcher: runs the bot's shards in several worker processes instead of one, each a full
+# bot started from main.py with its share of the shards, its own cogs and its own AI workers.
+#
+#   python cluster.py --clusters 4
+#   python cluster.py --clusters 4 --shards 16
+#
+# Without --shards the shard count recommended by Discord is used. SIGHUP restarts the workers
+# one at a time; SIGINT or SIGTERM stops them all. Keep the number of clusters the same between
+# runs, as each cluster only restores the games saved by the cluster with the same number.
+import argparse
+import asyncio
+import os
+import signal
+import sys
+
+import discord
+from dotenv import load_dotenv, find_dotenv
+
+from utils.cluster import ClusterLauncher
+
+load_dotenv(find_dotenv())
+TOKEN = os.getenv('TOKEN')
+
+async def recommended_shards():
+    # Shard count Discord recommends for the bot
+    client = discord.Client(intents=discord.Intents.none())
+    try:
+        await client.login(TOKEN)
+        shards, _ = await client.http.get_bot_gateway()
+    finally:
+        await client.close()
+    return shards
+
+async def run(args):
+    shard_count = args.shards or await recommended_shards()
+    env = dict(os.environ)
+    # Split the AI worker processes between the clusters unless set explicitly
+    env.setdefault("AI_WORKERS", str(max(1, (os.cpu_count() or 1) // args.clusters)))
+    launcher = ClusterLauncher(shard_count, args.clusters, env=env)
+    print(f"Starting {len(launcher.workers)} cluster(s) for {shard_count} shard(s)")
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(launcher.rolling_restart()))
+    except (NotImplementedError, AttributeError):
+        # No signal handlers on Windows; Ctrl+C still interrupts the launcher
+        pass
+
+    try:
+        await launcher.start()
+        await stop.wait()
+    finally:
+        print("Stopping clusters")
+        await launcher.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bot's shards in several worker processes.")
+    parser.add_argument("--clusters", type=int, default=os.cpu_count() or 1, help="worker processes, default one per CPU core")
+    parser.add_argument("--shards", type=int, help="total shard count, default Discord's recommendation")
+    args = parser.parse_args(argv)
+    if TOKEN is None and not os.getenv('STAND_IN_GATEWAY'):
+        print("Error: Discord bot TOKEN not found in the .env file.")
+        return 1
+    if args.shards is None and TOKEN is None:
+        print("Error: --shards is required without a TOKEN.")
+        return 1
+    asyncio.run(run(args))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,212 +2,1185 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from discord.ui import Button, View
-import random
+import asyncio
 import math
+import os
+import random
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Literal, NamedTuple, Optional
+import numpy as np
+from utils.ai_scheduler import INTERACTION_TOKEN_WINDOW, get_ai_scheduler
+from utils.board_images import get_board_renderer
+from utils.game_log import AI_GAME, DRAW, FORFEIT, get_game_log
+from utils.engines import Engine, MCTSEngine, Rules, SearchBudget, SearchResult, SearchTimeout
+from utils.message_editor import get_message_editor, message_fields
+from utils.opening_book import OpeningBook
+from utils.sessions import GameSession, get_session_registry
+from utils.metrics import metrics, NODE_BUCKETS
+
+# Player indices into Position.bitboards and the emoji used when rendering them
+RED = 0
+YELLOW = 1
+PIECE_EMOJIS = ("🔴", "🟡")
+EMPTY_EMOJI = "⚫"
+
+# Column number emojis of the board header, up to the widest variant
+COLUMN_EMOJIS = ("1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣")
+
+WIN_SCORE = 1000000
+
+# Wall-clock budget of one AI reply in seconds
+AI_TIME_BUDGET = 1.0
+
+class Difficulty(NamedTuple):
+    # How the AI plays one difficulty tier
+    engine: str
+    # Search limits, maximum depth (None for no limit) and seconds; the scheduler may cut the
+    # time further under load
+    depth: Optional[int]
+    time: float
+    # Once no more empty cells are left than this, the position is solved exactly instead, so the
+    # AI plays the end of the game perfectly
+    endgame_cells: int
+    # Whether positions in the opening book are answered from it without searching
+    book: bool
+
+DIFFICULTIES = {
+    "easy": Difficulty("alphabeta", 2, AI_TIME_BUDGET / 4, 0, False),
+    "normal": Difficulty("alphabeta", None, AI_TIME_BUDGET, 16, True),
+    "hard": Difficulty("alphabeta", None, AI_TIME_BUDGET * 1.5, 20, True),
+}
+# How long the human move's render waits for the AI reply so both go out in one edit,
+# kept below Discord's 3 second acknowledgement window
+AI_RENDER_HOLD = 2.0
+# Likeliest human moves whose AI reply is searched ahead while the human is thinking
+PONDER_REPLIES = 3
+
+# Memory cap of the transposition table kept by each AI engine, 4 MiB unless set in the
+# environment. Read here rather than in main.py, as the engines live in the AI worker processes,
+# which inherit the bot's environment.
+TRANSPOSITION_TABLE_BYTES = int(os.getenv('TRANSPOSITION_TABLE_BYTES', 4 * 1024 * 1024))
+
+# Nodes the exact endgame solver may visit before a search falls back to alpha-beta, the share
+# of the remaining search time it may use, and the positions it remembers between searches
+ENDGAME_NODE_BUDGET = 50000
+ENDGAME_TIME_SHARE = 0.5
+ENDGAME_TABLE_ENTRIES = 1 << 18
+
+# Bound types stored with transposition table entries
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Value of a window by its number of own pieces; windows holding pieces of both players are dead
+WINDOW_SCORES = (0, 1, 8, 64)
+# Window values indexed by [own pieces][opponent pieces], from the point of view of the owner
+WINDOW_TABLE = np.zeros((5, 5), dtype=np.int64)
+for _count in range(1, 4):
+    WINDOW_TABLE[_count, 0] = WINDOW_SCORES[_count]
+    WINDOW_TABLE[0, _count] = -WINDOW_SCORES[_count]
+WINDOW_TABLE_FLAT = WINDOW_TABLE.ravel()
+WINDOW_VALUES = WINDOW_TABLE.tolist()
+
+CENTRE_WEIGHT = 4
+GOOD_THREAT_WEIGHT = 96
+OTHER_THREAT_WEIGHT = 24
+
+def split_words(values, words):
+    # Split each bitboard into a list of 64-bit words, lowest first
+    return [[(value >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for word in range(words)] for value in values]
+
+class Geometry:
+    # Board size of a Connect 4 variant and every bitboard constant derived from it.
+    # Cell (row, col) maps to bit col * height + row, row 0 being the bottom row, and each
+    # column has a sentinel bit on top so lines never wrap from one column into the next.
+    __slots__ = (
+        "name", "columns", "rows", "height", "cells", "move_order", "zobrist_keys", "perspective_keys",
+        "board_mask", "bottom_mask", "column_masks", "centre_mask", "parity_masks", "window_masks", "words",
+        "window_words"
+    )
+
+    def __init__(self, columns, rows):
+        self.name = f"{columns}x{rows}"
+        self.columns = columns
+        self.rows = rows
+        self.height = rows + 1
+        self.cells = columns * rows
+        # Columns in the order they are searched, centre first since central moves are usually strongest
+        self.move_order = tuple(sorted(range(columns), key=lambda col: abs(2 * col - (columns - 1))))
 
-def create_board():
-    # Initialize a 6x7 Connect 4 grid with empty slots
-    return [["⚫" for _ in range(7)] for _ in range(6)]
+        # Zobrist keys, one random 64-bit number per player and bit index. The generator is seeded
+        # by the board size, so every process derives the same keys for the same position and
+        # positions of different variants never share table entries.
+        zobrist_random = random.Random(f"connect4:{self.name}")
+        self.zobrist_keys = [[zobrist_random.getrandbits(64) for _ in range(columns * self.height)] for _ in range(2)]
+        # Mixed into table keys so scores searched for one player are never reused for the other
+        self.perspective_keys = [zobrist_random.getrandbits(64) for _ in range(2)]
+
+        column_mask = (1 << rows) - 1
+        self.board_mask = sum(column_mask << (col * self.height) for col in range(columns))
+        self.bottom_mask = sum(1 << (col * self.height) for col in range(columns))
+        self.column_masks = tuple(column_mask << (col * self.height) for col in range(columns))
+        # The middle column, or both middle columns of an even width
+        self.centre_mask = sum(column_mask << (col * self.height) for col in self.move_order[:2 - columns % 2])
+        # Threats are empty cells that would complete a line. When the board fills up, zugzwang lets
+        # the first player take the cells on odd rows counting from the bottom and the second
+        # player those on even rows, so threats on the player's own rows are worth more.
+        odd_rows = sum(1 << row for row in range(0, rows, 2))
+        odd_rows_mask = sum(odd_rows << (col * self.height) for col in range(columns))
+        self.parity_masks = (odd_rows_mask, self.board_mask ^ odd_rows_mask)
+
+        # Bitmasks of the groups of four cells that can form a line, 69 on the standard board,
+        # also split into 64-bit words for NumPy since larger boards take more than 64 bits
+        self.window_masks = []
+        for row in range(rows):
+            for col in range(columns):
+                for d_row, d_col in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+                    cells = [(row + i * d_row, col + i * d_col) for i in range(4)]
+                    if all(0 <= r < rows and 0 <= c < columns for r, c in cells):
+                        self.window_masks.append(sum(1 << (c * self.height + r) for r, c in cells))
+        self.words = (columns * self.height + 63) // 64
+        self.window_words = np.array(split_words(self.window_masks, self.words), dtype=np.uint64).T.copy()
+
+# Board sizes offered by the play command, as columns x rows
+VARIANTS = {name: Geometry(*map(int, name.split("x"))) for name in ("7x6", "8x7", "9x7")}
+STANDARD = VARIANTS["7x6"]
+
+class Position:
+    # Compact Connect 4 position: one bitboard per player plus the fill height of each column,
+    # laid out by the position's Geometry.
+    # The Zobrist hash of the position is kept up to date by make_move/unmake_move.
+    __slots__ = ("geometry", "bitboards", "heights", "moves", "hash")
+
+    def __init__(self, geometry=STANDARD):
+        self.geometry = geometry
+        self.bitboards = [0, 0]
+        self.heights = [0] * geometry.columns
+        self.moves = 0
+        self.hash = 0
+
+    def copy(self):
+        position = Position(self.geometry)
+        position.bitboards = self.bitboards[:]
+        position.heights = self.heights[:]
+        position.moves = self.moves
+        position.hash = self.hash
+        return position
+
+    def to_payload(self):
+        # Picklable snapshot used to send the position to a search worker
+        return (self.geometry.name, self.bitboards[RED], self.bitboards[YELLOW], tuple(self.heights))
+
+    @classmethod
+    def from_payload(cls, payload):
+        if len(payload) == 3:
+            # Saved before board sizes were configurable
+            payload = (STANDARD.name, *payload)
+        name, red, yellow, heights = payload
+        position = cls(VARIANTS[name])
+        position.bitboards = [red, yellow]
+        position.heights = list(heights)
+        position.moves = sum(heights)
+        zobrist_keys = position.geometry.zobrist_keys
+        for player, bits in enumerate(position.bitboards):
+            while bits:
+                low = bits & -bits
+                position.hash ^= zobrist_keys[player][low.bit_length() - 1]
+                bits ^= low
+        return position
+
+    def cell(self, row, col):
+        # Return the player occupying a cell, or None if it is empty
+        bit = 1 << (col * self.geometry.height + row)
+        if self.bitboards[RED] & bit:
+            return RED
+        if self.bitboards[YELLOW] & bit:
+            return YELLOW
+        return None
+
+class TranspositionTable:
+    # Fixed-size table of search results keyed by Zobrist hash, bounded by a memory cap.
+    # Each slot holds (key, depth, bound, value, best_move, generation). A slot is replaced when it
+    # holds the same position, was written by an earlier search, or the new result is at least as deep.
+    ENTRY_BYTES = 160  # estimated size of one stored entry including its slot
+
+    __slots__ = ("size", "mask", "entries", "generation", "hits", "misses", "stores", "overwrites")
+
+    def __init__(self, max_bytes=TRANSPOSITION_TABLE_BYTES):
+        size = 1
+        while size * 2 * self.ENTRY_BYTES <= max_bytes:
+            size *= 2
+        self.size = size
+        self.mask = size - 1
+        self.entries = [None] * size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        # Age existing entries so the next search may overwrite them
+        self.generation += 1
+
+    def lookup(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, bound, value, best_move):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is not None:
+            if entry[0] != key and entry[5] == self.generation and entry[1] > depth:
+                return
+            if entry[0] != key:
+                self.overwrites += 1
+        self.entries[index] = (key, depth, bound, value, best_move, self.generation)
+        self.stores += 1
+
+    def counters(self):
+        # (hits, misses, stores, overwrites) so far, cheap enough to read around every search
+        return self.hits, self.misses, self.stores, self.overwrites
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.hits = self.misses = self.stores = self.overwrites = 0
+
+    def stats(self):
+        # Counters used to size the table for a deployment
+        probes = self.hits + self.misses
+        return {
+            "size": self.size,
+            "used": self.size - self.entries.count(None),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / probes if probes else 0.0,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+        }
+
+def create_board(geometry=STANDARD):
+    # Initialize an empty Connect 4 position, 7 columns by 6 rows unless another variant is given
+    return Position(geometry)
 
 def board_to_string(board, last_move_col=None):
     # Convert the board to a string, with an indicator for the last move
-    top_row = "".join("⬇️" if col == last_move_col else "▪️" for col in range(7))
-    column_emojis = "\n1️⃣2️⃣3️⃣4️⃣5️⃣6️⃣7️⃣"
-    board_str = "\n".join("".join(row) for row in reversed(board))
+    geometry = board.geometry
+    top_row = "".join("⬇️" if col == last_move_col else "▪️" for col in range(geometry.columns))
+    column_emojis = "\n" + "".join(COLUMN_EMOJIS[:geometry.columns])
+    red, yellow = board.bitboards
+    rows = []
+    for row in reversed(range(geometry.rows)):
+        cells = []
+        for col in range(geometry.columns):
+            bit = 1 << (col * geometry.height + row)
+            cells.append(PIECE_EMOJIS[RED] if red & bit else PIECE_EMOJIS[YELLOW] if yellow & bit else EMPTY_EMOJI)
+        rows.append("".join(cells))
+    board_str = "\n".join(rows)
     return f"{top_row}\n{board_str}\n{column_emojis}"
 
+def board_to_grid(board, last_move_col=None):
+    # Tile names of the board image: the last move marker, the rows top-down and column numbers
+    geometry = board.geometry
+    red, yellow = board.bitboards
+    grid = [["arrow" if col == last_move_col else "blank" for col in range(geometry.columns)]]
+    for row in reversed(range(geometry.rows)):
+        cells = []
+        for col in range(geometry.columns):
+            bit = 1 << (col * geometry.height + row)
+            cells.append("c4:red" if red & bit else "c4:yellow" if yellow & bit else "c4:hole")
+        grid.append(cells)
+    grid.append([f"label:{col + 1}" for col in range(geometry.columns)])
+    return grid
+
 def is_valid_move(board, col):
     # Check if a column has space for another move
-    return board[5][col] == "⚫"
-
-def make_move(board, col, player_emoji):
-    # Place the player's token in the lowest available row in the column
-    for row in range(6):
-        if board[row][col] == "⚫":
-            board[row][col] = player_emoji
-            break
-
-def check_winner(board, player_emoji):
-    # Check all directions to see if the player has four in a row
-    def check_line(start_row, start_col, delta_row, delta_col):
-        # Helper function to check a line of four in any direction
-        for i in range(4):
-            row = start_row + i * delta_row
-            col = start_col + i * delta_col
-            if not (0 <= row < 6 and 0 <= col < 7) or board[row][col] != player_emoji:
-                return False
-        return True
-
-    # Scan the board in all directions for a winning line
-    for row in range(6):
-        for col in range(7):
-            if (check_line(row, col, 0, 1) or  # Horizontal
-                check_line(row, col, 1, 0) or  # Vertical
-                check_line(row, col, 1, 1) or  # Diagonal down-right
-                check_line(row, col, -1, 1)):  # Diagonal up-right
-                return True
+    return board.heights[col] < board.geometry.rows
+
+def make_move(board, col, player):
+    # Drop the player's token in the lowest available row in the column
+    index = col * board.geometry.height + board.heights[col]
+    board.bitboards[player] |= 1 << index
+    board.hash ^= board.geometry.zobrist_keys[player][index]
+    board.heights[col] += 1
+    board.moves += 1
+
+def unmake_move(board, col, player):
+    # Take back the top token of the column, undoing make_move
+    board.heights[col] -= 1
+    board.moves -= 1
+    index = col * board.geometry.height + board.heights[col]
+    board.bitboards[player] ^= 1 << index
+    board.hash ^= board.geometry.zobrist_keys[player][index]
+
+def check_winner(board, player):
+    # Shift-and-mask test for four in a row: vertical, horizontal and both diagonals.
+    # It costs the same few operations whatever the board size.
+    bits = board.bitboards[player]
+    height = board.geometry.height
+    for shift in (1, height, height - 1, height + 1):
+        pairs = bits & (bits >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
     return False
 
+def winning_cells(bits, occupied, geometry):
+    # Empty cells that would complete four in a row for the owner of bits. Works on Python ints
+    # as well as NumPy uint64 arrays of positions.
+    cells = (bits << 1) & (bits << 2) & (bits << 3)
+    height = geometry.height
+    for shift in (height, height - 1, height + 1):
+        pairs = (bits << shift) & (bits << 2 * shift)
+        cells |= pairs & (bits << 3 * shift)
+        cells |= pairs & (bits >> shift)
+        pairs = (bits >> shift) & (bits >> 2 * shift)
+        cells |= pairs & (bits << shift)
+        cells |= pairs & (bits >> 3 * shift)
+    return cells & (geometry.board_mask ^ occupied)
+
+def threat_score(threats, player, geometry):
+    # Weigh a player's threats by whether zugzwang hands them the rows they are on
+    good = threats & geometry.parity_masks[player]
+    return GOOD_THREAT_WEIGHT * good.bit_count() + OTHER_THREAT_WEIGHT * (threats ^ good).bit_count()
+
+def evaluate(board, player):
+    # Heuristic score of a position without a winner, from the player's point of view:
+    # open windows, pieces in the centre column and threats on the rows the player can claim
+    geometry = board.geometry
+    own, opp = board.bitboards[player], board.bitboards[1 - player]
+    occupied = own | opp
+    score = 0
+    for mask in geometry.window_masks:
+        score += WINDOW_VALUES[(own & mask).bit_count()][(opp & mask).bit_count()]
+    centre_mask = geometry.centre_mask
+    score += CENTRE_WEIGHT * ((own & centre_mask).bit_count() - (opp & centre_mask).bit_count())
+    score += threat_score(winning_cells(own, occupied, geometry), player, geometry)
+    score -= threat_score(winning_cells(opp, occupied, geometry), 1 - player, geometry)
+    return score
+
+def evaluate_children(board, moves, mover):
+    # Same score as evaluate for each position after mover plays one of the moves, from the
+    # mover's point of view. Window counts for all children come from one batch of array
+    # operations; threats only change around the dropped piece, so they stay on Python ints.
+    geometry = board.geometry
+    own, opp = board.bitboards[mover], board.bitboards[1 - mover]
+    heights = board.heights
+    height = geometry.height
+    move_bits = [1 << (col * height + heights[col]) for col in moves]
+    children = np.array(split_words([own | bit for bit in move_bits], geometry.words), dtype=np.uint64)
+    opp_words = split_words([opp], geometry.words)[0]
+    window_words = geometry.window_words
+    own_counts = np.bitwise_count(children[:, 0, None] & window_words[0])
+    opp_counts = np.bitwise_count(window_words[0] & np.uint64(opp_words[0]))
+    for word in range(1, geometry.words):
+        own_counts += np.bitwise_count(children[:, word, None] & window_words[word])
+        opp_counts += np.bitwise_count(window_words[word] & np.uint64(opp_words[word]))
+    window_scores = WINDOW_TABLE_FLAT.take(own_counts * 5 + opp_counts).sum(axis=1).tolist()
+
+    occupied = own | opp
+    opp_threats = winning_cells(opp, occupied, geometry)
+    centre_mask = geometry.centre_mask
+    centre = CENTRE_WEIGHT * ((own & centre_mask).bit_count() - (opp & centre_mask).bit_count())
+    scores = []
+    for bit, score in zip(move_bits, window_scores):
+        if bit & centre_mask:
+            score += CENTRE_WEIGHT
+        score += threat_score(winning_cells(own | bit, occupied | bit, geometry), mover, geometry)
+        score -= threat_score(opp_threats & ~bit, 1 - mover, geometry)
+        scores.append(centre + score)
+    return scores
+
 def get_valid_moves(board):
-    # Return list of columns that still have space for moves
-    return [col for col in range(7) if is_valid_move(board, col)]
+    # Return list of columns that still have space for moves, centre columns first
+    heights = board.heights
+    rows = board.geometry.rows
+    return [col for col in board.geometry.move_order if heights[col] < rows]
 
 def is_terminal_node(board):
     # Check if the game is over (win or full board)
-    return check_winner(board, "🔴") or check_winner(board, "🟡") or len(get_valid_moves(board)) == 0
+    return check_winner(board, RED) or check_winner(board, YELLOW) or board.moves == board.geometry.cells
+
+def minimax(board, depth, alpha, beta, maximizing_player, player, table=None, budget=None, heuristic=True):
+    # Recursive minimax with alpha-beta pruning for AI move calculation.
+    # Moves are made and taken back on the same position, so no node copies the board.
+    # With a transposition table, positions reached by another move order reuse earlier results.
+    # With a budget, SearchTimeout is raised once its node or time limit is reached.
+    # With heuristic set, leaves are scored by evaluate instead of as draws, and nodes one ply
+    # above the leaves score all their children in a single evaluate_children call.
+    opponent = 1 - player
+    if budget is not None:
+        budget.tick()
+
+    # Only the side that just moved can have completed a line
+    if check_winner(board, opponent if maximizing_player else player):
+        return (None, -WIN_SCORE if maximizing_player else WIN_SCORE)
+
+    # End recursion if the board is full or depth limit is reached
+    if board.moves == board.geometry.cells:
+        return (None, 0)
+    if depth == 0:
+        return (None, evaluate(board, player) if heuristic else 0)
 
-def minimax(board, depth, alpha, beta, maximizing_player, player_emoji):
-    # Recursive minimax with alpha-beta pruning for AI move calculation
-    opponent_emoji = "🔴" if player_emoji == "🟡" else "🟡"
     valid_moves = get_valid_moves(board)
-    is_terminal = is_terminal_node(board)
-
-    # End recursion if terminal state or depth limit is reached
-    if depth == 0 or is_terminal:
-        if check_winner(board, player_emoji):
-            return (None, 1000000)
-        elif check_winner(board, opponent_emoji):
-            return (None, -1000000)
-        else:
-            return (None, 0)
+    if depth == 1 and heuristic:
+        return frontier(board, valid_moves, maximizing_player, player, budget)
+
+    if table is not None:
+        key = board.hash ^ board.geometry.perspective_keys[player]
+        alpha_orig, beta_orig = alpha, beta
+        entry = table.lookup(key)
+        if entry is not None:
+            entry_depth, bound, value, table_move = entry[1], entry[2], entry[3], entry[4]
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return table_move, value
+                if bound == LOWER_BOUND:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if beta <= alpha:
+                    return table_move, value
+            # Search the stored best move first
+            valid_moves.remove(table_move)
+            valid_moves.insert(0, table_move)
 
     # Choose best move for maximizing or minimizing player
     if maximizing_player:
-        max_eval = -math.inf
-        best_col = random.choice(valid_moves)
+        best_eval = -math.inf
+        best_col = valid_moves[0]
         for col in valid_moves:
-            temp_board = [row[:] for row in board]
-            make_move(temp_board, col, player_emoji)
-            eval = minimax(temp_board, depth - 1, alpha, beta, False, player_emoji)[1]
-            if eval > max_eval:
-                max_eval = eval
+            make_move(board, col, player)
+            try:
+                eval = minimax(board, depth - 1, alpha, beta, False, player, table, budget, heuristic)[1]
+            finally:
+                unmake_move(board, col, player)
+            if eval > best_eval:
+                best_eval = eval
                 best_col = col
             alpha = max(alpha, eval)
             if beta <= alpha:
                 break
-        return best_col, max_eval
     else:
-        min_eval = math.inf
-        best_col = random.choice(valid_moves)
+        best_eval = math.inf
+        best_col = valid_moves[0]
         for col in valid_moves:
-            temp_board = [row[:] for row in board]
-            make_move(temp_board, col, opponent_emoji)
-            eval = minimax(temp_board, depth - 1, alpha, beta, True, player_emoji)[1]
-            if eval < min_eval:
-                min_eval = eval
+            make_move(board, col, opponent)
+            try:
+                eval = minimax(board, depth - 1, alpha, beta, True, player, table, budget, heuristic)[1]
+            finally:
+                unmake_move(board, col, opponent)
+            if eval < best_eval:
+                best_eval = eval
                 best_col = col
             beta = min(beta, eval)
             if beta <= alpha:
                 break
-        return best_col, min_eval
 
-class Connect4View(View):
-    def __init__(self, player1, player2, is_ai=False):
-        super().__init__(timeout=300)
-        self.player1 = player1
-        self.player2 = player2
+    if table is not None:
+        if best_eval <= alpha_orig:
+            bound = UPPER_BOUND
+        elif best_eval >= beta_orig:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        table.store(key, depth, bound, best_eval, best_col)
+    return best_col, best_eval
+
+def frontier(board, moves, maximizing_player, player, budget=None):
+    # Score every child of a node one ply above the leaves without recursing into them: a move
+    # that wins ends the game, one that fills the board is a draw and the rest are evaluated
+    mover = player if maximizing_player else 1 - player
+    if budget is not None:
+        budget.tick(len(moves))
+    scores = evaluate_children(board, moves, mover)
+    geometry = board.geometry
+    red, yellow = board.bitboards
+    wins = winning_cells(board.bitboards[mover], red | yellow, geometry)
+    heights = board.heights
+    last_move = board.moves + 1 == geometry.cells
+    for i, col in enumerate(moves):
+        if wins & 1 << (col * geometry.height + heights[col]):
+            scores[i] = WIN_SCORE
+        elif last_move:
+            scores[i] = 0
+    if mover != player:
+        scores = [-score for score in scores]
+    best = max(scores) if maximizing_player else min(scores)
+    return moves[scores.index(best)], best
+
+class AlphaBetaEngine(Engine):
+    # Anytime alpha-beta search: run minimax one ply deeper at a time until the budget runs out
+    # and play the best move of the deepest completed iteration. Each iteration stores its best
+    # moves in the transposition table, so the next one searches the previous principal
+    # variation first, then the remaining columns centre first.
+    name = "alphabeta"
+
+    def __init__(self, table=None, heuristic=True):
+        self.table = TranspositionTable() if table is None else table
+        self.heuristic = heuristic
+
+    def reset(self):
+        self.table.clear()
+
+    def search(self, board, player, budget):
+        self.table.new_search()
+        remaining = board.geometry.cells - board.moves
+        max_depth = remaining if budget.max_depth is None else min(budget.max_depth, remaining)
+
+        best_col, best_eval, completed = get_valid_moves(board)[0], 0, 0
+        for depth in range(1, max_depth + 1):
+            try:
+                col, eval = minimax(board, depth, -math.inf, math.inf, True, player, self.table, budget, self.heuristic)
+            except SearchTimeout:
+                break
+            best_col, best_eval, completed = col, eval, depth
+            # A forced win or loss will not change with more depth
+            if abs(eval) == WIN_SCORE:
+                break
+        return SearchResult(best_col, best_eval, completed, budget.nodes)
+
+class EndgameSolver(Engine):
+    # Exact negamax solver for positions with few empty cells. Scores are the number of cells
+    # the winner still has empty when the game ends, from the point of view of the player to
+    # move, so the solver takes the fastest win and the slowest loss. The value is narrowed down
+    # by null-window searches, each only answering whether it is above a guess. Moves that hand
+    # the opponent a win are never searched, and the others are ordered by the threats they
+    # create. Bounds found are kept per position and stay valid in later searches, as they do not
+    # depend on any search limit. Raises SearchTimeout when the budget runs out.
+    name = "endgame"
+
+    def __init__(self):
+        # Geometry name -> {position key: (bound, value)}
+        self.tables = {}
+
+    def reset(self):
+        self.tables.clear()
+
+    def search(self, board, player, budget):
+        geometry = board.geometry
+        table = self.tables.setdefault(geometry.name, {})
+        if len(table) > ENDGAME_TABLE_ENTRIES:
+            table.clear()
+        current = board.bitboards[player]
+        mask = current | board.bitboards[1 - player]
+        moves = board.moves
+        remaining = geometry.cells - moves
+        start_nodes = budget.nodes
+
+        possible = (mask + geometry.bottom_mask) & geometry.board_mask
+        wins = winning_cells(current, mask, geometry) & possible
+        if wins:
+            col = ((wins & -wins).bit_length() - 1) // geometry.height
+            return SearchResult(col, WIN_SCORE, 1, budget.nodes - start_nodes)
+
+        value = self.solve(current, mask, moves, geometry, table, budget)
+        # The first move, in search order, whose value reaches the position's is the best one
+        ordered = self.ordered(current, mask, possible, geometry)
+        best = ordered[0]
+        for bit in ordered:
+            if -self.negamax(current ^ mask, mask | bit, moves + 1, -value, 1 - value, geometry, table, budget) >= value:
+                best = bit
+                break
+        best_col = (best.bit_length() - 1) // geometry.height
+        score = WIN_SCORE if value > 0 else -WIN_SCORE if value < 0 else 0
+        return SearchResult(best_col, score, remaining, budget.nodes - start_nodes)
+
+    def solve(self, current, mask, moves, geometry, table, budget):
+        # Exact value of the position, found by null-window searches that halve the range of
+        # possible values each time, trying values close to zero first
+        cells = geometry.cells
+        low, high = -((cells - moves) // 2), (cells + 1 - moves) // 2
+        while low < high:
+            guess = low + (high - low) // 2
+            if guess <= 0 and int(low / 2) < guess:
+                guess = int(low / 2)
+            elif guess >= 0 and int(high / 2) > guess:
+                guess = int(high / 2)
+            value = self.negamax(current, mask, moves, guess, guess + 1, geometry, table, budget)
+            if value <= guess:
+                high = value
+            else:
+                low = value
+        return low
+
+    def ordered(self, current, mask, possible, geometry):
+        # Playable cells in possible, those completing the most lines for the mover first and
+        # centre first among equals
+        scored = []
+        for col in geometry.move_order:
+            bit = possible & geometry.column_masks[col]
+            if bit:
+                scored.append((winning_cells(current | bit, mask | bit, geometry).bit_count(), bit))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return [bit for _, bit in scored]
+
+    def negamax(self, current, mask, moves, alpha, beta, geometry, table, budget):
+        # Value of the position for the player to move, exact when it lies between alpha and beta,
+        # otherwise only a bound on the side it falls
+        budget.tick()
+        cells = geometry.cells
+        possible = (mask + geometry.bottom_mask) & geometry.board_mask
+        if winning_cells(current, mask, geometry) & possible:
+            return (cells + 1 - moves) // 2
+
+        # A threat of the opponent's that is playable must be blocked; two of them cannot be
+        opponent = current ^ mask
+        threats = winning_cells(opponent, mask, geometry)
+        forced = possible & threats
+        if forced:
+            if forced & (forced - 1):
+                return -((cells - moves) // 2)
+            possible = forced
+        # Never play right below a cell where the opponent would win
+        possible &= ~(threats >> 1)
+        if not possible:
+            return -((cells - moves) // 2)
+        if moves >= cells - 2:
+            return 0
+
+        # Neither side can win sooner than their next moves allow
+        low = -((cells - 2 - moves) // 2)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+        high = (cells - 1 - moves) // 2
+        key = current + mask
+        entry = table.get(key)
+        if entry is not None:
+            if entry[0] == UPPER_BOUND:
+                high = min(high, entry[1])
+            elif entry[1] > alpha:
+                alpha = entry[1]
+                if alpha >= beta:
+                    return alpha
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+
+        for bit in self.ordered(current, mask, possible, geometry):
+            value = -self.negamax(opponent, mask | bit, moves + 1, -beta, -alpha, geometry, table, budget)
+            if value >= beta:
+                table[key] = (LOWER_BOUND, value)
+                return value
+            if value > alpha:
+                alpha = value
+        table[key] = (UPPER_BOUND, alpha)
+        return alpha
+
+def endgame_search(engine, board, player, budget, endgame_cells):
+    # Search with engine, or solve the position exactly instead once at most endgame_cells cells
+    # are empty. The solver gets its own node budget and a share of the remaining time; if it
+    # runs out, the engine searches with what is left. Returns (SearchResult, endgame), endgame
+    # being None when the solver was not tried, else (solved, nodes visited by the solver).
+    if board.geometry.cells - board.moves > endgame_cells:
+        return engine.search(board, player, budget), None
+    solver_budget = SearchBudget(node_budget=ENDGAME_NODE_BUDGET)
+    if budget.max_nodes is not None:
+        solver_budget.max_nodes = min(ENDGAME_NODE_BUDGET, budget.max_nodes)
+    if budget.deadline is not None:
+        now = time.perf_counter()
+        solver_budget.deadline = now + max(0.0, budget.deadline - now) * ENDGAME_TIME_SHARE
+    try:
+        return get_engine("endgame").search(board, player, solver_budget), (True, solver_budget.nodes)
+    except SearchTimeout:
+        pass
+    budget.nodes += solver_budget.nodes
+    result = engine.search(board, player, budget)
+    return result, (False, solver_budget.nodes)
+
+class Connect4Rules(Rules):
+    # Connect 4 rules for the game-independent engines. Heuristic rollouts take a winning cell
+    # when there is one, block the opponent's, and avoid dropping a piece right below a cell
+    # where the opponent would win; otherwise, and in plain random rollouts, they play a
+    # random column.
+    def __init__(self, heuristic=True):
+        self.heuristic = heuristic
+
+    def moves(self, board):
+        return get_valid_moves(board)
+
+    def play(self, board, col, player):
+        make_move(board, col, player)
+
+    def won(self, board, col, player):
+        return check_winner(board, player)
+
+    def full(self, board):
+        return board.moves == board.geometry.cells
+
+    def other(self, player):
+        return 1 - player
+
+    def copy(self, board):
+        return board.copy()
+
+    def key(self, board):
+        return (board.geometry.name, *board.bitboards)
+
+    def rollout(self, board, player, rng, budget):
+        # Plays on the bitboards only, the lowest empty cell of each column being one bit of
+        # (occupied + bottom_mask)
+        geometry = board.geometry
+        own, opp = board.bitboards[player], board.bitboards[1 - player]
+        occupied = own | opp
+        for _ in range(geometry.cells - board.moves):
+            budget.tick()
+            playable = (occupied + geometry.bottom_mask) & geometry.board_mask
+            wins = winning_cells(own, occupied, geometry) & playable
+            if self.heuristic and wins:
+                return player
+            cells = []
+            while playable:
+                cell = playable & -playable
+                cells.append(cell)
+                playable ^= cell
+            if self.heuristic:
+                threats = winning_cells(opp, occupied, geometry)
+                blocks = [cell for cell in cells if cell & threats]
+                if blocks:
+                    cells = blocks
+                else:
+                    cells = [cell for cell in cells if not (cell << 1) & threats] or cells
+            cell = rng.choice(cells)
+            if cell & wins:
+                return player
+            own, opp = opp, own | cell
+            occupied |= cell
+            player = 1 - player
+        return None
+
+# Engine factories by name. Each process builds its engines once and reuses them for every
+# search, so transposition tables and MCTS trees carry over between turns. Table keys include
+# the searching player, so games never read each other's scores for the wrong side.
+ENGINES = {
+    "alphabeta": lambda: AlphaBetaEngine(),
+    "mcts": lambda: MCTSEngine(Connect4Rules()),
+    "endgame": lambda: EndgameSolver(),
+}
+_engines = {}
+
+def get_engine(name):
+    # Engine of the current process with the given name
+    engine = _engines.get(name)
+    if engine is None:
+        engine = _engines[name] = ENGINES[name]()
+    return engine
+
+def mirror_bits(bits, geometry):
+    # Bitboard with the columns in reverse order
+    height = geometry.height
+    column_mask = (1 << height) - 1
+    mirrored = 0
+    for col in range(geometry.columns):
+        mirrored |= ((bits >> (col * height)) & column_mask) << ((geometry.columns - 1 - col) * height)
+    return mirrored
+
+def book_key(board):
+    # Opening book key of the position and whether it is the key of the mirrored position. Red's
+    # pieces plus the occupied cells plus the bottom row identify a position in one integer of
+    # columns * height bits; a position and its mirror image share the smaller of their two keys.
+    geometry = board.geometry
+    red, yellow = board.bitboards
+    key = red + (red | yellow) + geometry.bottom_mask
+    mirrored = mirror_bits(red, geometry) + mirror_bits(red | yellow, geometry) + geometry.bottom_mask
+    return (mirrored, True) if mirrored < key else (key, False)
+
+def book_path(book_dir, geometry):
+    return os.path.join(book_dir, f"connect4-{geometry.name}.book")
+
+# Opening books of the current process by path, None for a missing or unreadable book. A book is
+# only opened once per process; restart the bot to pick up a rebuilt one.
+_books = {}
+
+def get_opening_book(book_dir, geometry):
+    path = book_path(book_dir, geometry)
+    if path not in _books:
+        book = None
+        if os.path.exists(path):
+            try:
+                book = OpeningBook(path)
+                if book.name != f"c4:{geometry.name}":
+                    book.close()
+                    raise ValueError(f"{path} is a book of {book.name}")
+            except (OSError, ValueError) as e:
+                print(f"Ignoring opening book: {e}")
+                book = None
+        _books[path] = book
+    return _books[path]
+
+def book_move(board, book_dir):
+    # Column stored in the opening book for the position, or None when it is not in the book
+    book = get_opening_book(book_dir, board.geometry)
+    if book is None or board.moves > book.max_ply:
+        return None
+    key, mirrored = book_key(board)
+    value = book.lookup(key)
+    if value is None:
+        return None
+    return board.geometry.columns - 1 - value[0] if mirrored else value[0]
+
+def get_opening_book_dir(client):
+    # Directory the bot's opening books are in, None for clients started without one, e.g. when
+    # the cog is loaded on its own
+    return getattr(client, "opening_book_dir", None)
+
+class SearchReport(NamedTuple):
+    # What search_move sends back from the worker, for the cog to play and record
+    move: int
+    nodes: int
+    seconds: float
+    # As returned by endgame_search
+    endgame: tuple = None
+    # Whether the move came from the opening book, None when no book was consulted
+    book: bool = None
+    # Transposition table (hits, misses, stores, overwrites) during the search, None for engines
+    # without a table
+    table: tuple = None
+
+def search_move(payload, player, engine="alphabeta", depth=None, endgame_cells=0, book_dir=None, time_budget=None,
+                node_budget=None):
+    # Entry point for AI searches run through the AI service, in a worker process or thread.
+    # Positions in the opening book of book_dir are answered from it without searching.
+    start = time.perf_counter()
+    board = Position.from_payload(payload)
+    book = None
+    if book_dir is not None:
+        col = book_move(board, book_dir)
+        if col is not None:
+            return SearchReport(col, 0, time.perf_counter() - start, book=True)
+        book = False
+    engine = get_engine(engine)
+    table = getattr(engine, "table", None)
+    before = table.counters() if table is not None else None
+    result, endgame = endgame_search(engine, board, player, SearchBudget(time_budget, node_budget, depth), endgame_cells)
+    if table is not None:
+        table = tuple(after - count for after, count in zip(table.counters(), before))
+    return SearchReport(result.move, result.nodes, time.perf_counter() - start, endgame, book, table)
+
+class Connect4Session(GameSession):
+    # Compact record of one Connect 4 game. Players are kept as ids and names, never as User
+    # objects, and the buttons are rebuilt from this state on every render.
+    KIND = "c4"
+    __slots__ = ("player_ids", "player_names", "is_ai", "difficulty", "current", "board", "last_move_col", "ai_future",
+                 "images", "ponder_task", "ponder_search", "ponder_results", "moves")
+
+    def __init__(self, player1, player2, is_ai=False, difficulty="normal", size=STANDARD.name, images=False):
+        self.player_ids = (player1.id, player2.id)
+        self.player_names = (player1.name, player2.name)
         self.is_ai = is_ai
-        self.current_turn = player1
-        self.player_emojis = {player1: "🔴", player2: "🟡"}
-        self.board = create_board()
+        self.difficulty = difficulty
+        self.current = RED
+        self.board = create_board(VARIANTS[size])
         self.last_move_col = None
-        self.message = None
+        self.ai_future = None
+        self.images = images
+        self.ponder_task = None
+        self.ponder_search = None
+        self.ponder_results = {}
+        # Columns played so far, for the game log
+        self.moves = []
+
+    def mention(self, player):
+        return f"<@{self.player_ids[player]}>"
+
+    def render(self, client, status, color_player, finished=False):
+        # Embed and buttons showing the board with a status line underneath. In image mode the
+        # board is a PNG attachment instead of emoji text; it is drawn off the event loop and the
+        # message editor waits for it when it sends the render.
+        embed = discord.Embed(
+            title=f"{self.player_names[RED]} vs {self.player_names[YELLOW]}",
+            color=discord.Color.red() if color_player == RED else discord.Color.yellow()
+        )
+        fields = {"embed": embed, "view": None if finished else build_view(self)}
+        if self.images:
+            red, yellow = self.board.bitboards
+            key = (self.KIND, self.board.geometry.name, red, yellow, self.last_move_col)
+            png = get_board_renderer(client).render(key, board_to_grid(self.board, self.last_move_col))
+            embed.description = status
+            embed.set_image(url="attachment://board.png")
+            fields["attachments"] = [("board.png", png)]
+        else:
+            embed.description = f"{board_to_string(self.board, self.last_move_col)}\n\n{status}"
+        return fields
 
-        # Add buttons for each column and a forfeit button
-        for i in range(7):
-            button = Button(label=str(i + 1), style=discord.ButtonStyle.blurple, custom_id=str(i))
-            button.callback = self.make_move_callback(i)
-            self.add_item(button)
+    def render_turn(self, client):
+        return self.render(client, f"**Current turn:** {self.mention(self.current)}", self.current)
 
-        forfeit_button = Button(label="Forfeit", style=discord.ButtonStyle.danger)
-        forfeit_button.callback = self.forfeit_game
-        self.add_item(forfeit_button)
+    async def dispatch(self, interaction: discord.Interaction, action: str):
+        if action == "forfeit":
+            await self.forfeit_game(interaction)
+        elif self.is_ai and self.current == YELLOW and self.ai_future is None and interaction.user.id == self.player_ids[RED]:
+            # A restart interrupted the AI's reply; any press of the human player resumes it
+            await self.make_ai_move(interaction)
+        else:
+            await self.make_move(interaction, int(action))
 
     async def forfeit_game(self, interaction: discord.Interaction):
         # Handle player forfeit and declare the opponent as the winner
-        winner = self.player2 if interaction.user == self.player1 else self.player1
-        embed = discord.Embed(
-            title=f"{self.player1.name} vs {self.player2.name}",
-            description=f"{board_to_string(self.board, self.last_move_col)}\n\n**{winner.mention} wins the game by forfeit!**",
-            color=discord.Color.red() if winner == self.player1 else discord.Color.yellow()
+        if interaction.user.id not in self.player_ids:
+            await interaction.response.send_message("You are not playing in this game.", ephemeral=True)
+            return
+        winner = YELLOW if interaction.user.id == self.player_ids[RED] else RED
+        status = f"**{self.mention(winner)} wins the game by forfeit!**"
+        render = self.render(interaction.client, status, winner, finished=True)
+        get_message_editor(interaction.client).submit(interaction, **render)
+        self.end_game(interaction.client, winner, forfeit=True)
+
+    def end_game(self, client, winner=None, forfeit=False):
+        # Unregister and log the game, won by winner or drawn when it is None, and drop any AI
+        # search still running for it
+        get_session_registry(client).remove(self)
+        self.expire()
+        flags = (AI_GAME if self.is_ai else 0) | (FORFEIT if forfeit else 0)
+        get_game_log(client).record(
+            self.KIND, self.board.geometry.name, DRAW if winner is None else winner, flags, self.player_ids, self.moves
         )
-        await interaction.response.edit_message(embed=embed, view=None)
-        self.stop()
 
-    def make_move_callback(self, col):
+    def expire(self):
+        if self.ai_future is not None:
+            self.ai_future.cancel()
+        self.stop_ponder()
+
+    def start_ponder(self, client):
+        # Search the AI's replies to the human's likeliest moves while the human is thinking
+        if self.is_ai and get_ai_scheduler(client).ponder_slots:
+            self.stop_ponder()
+            self.ponder_task = asyncio.ensure_future(self.ponder(client))
+
+    async def ponder(self, client):
+        # The human's moves are ranked by the static evaluation, and the positions after the best
+        # few are searched one at a time at ponder priority with the full budget of the
+        # difficulty, so a pondered reply is as strong as one searched after the move
+        board = self.board
+        moves = get_valid_moves(board)
+        ranked = sorted(zip(evaluate_children(board, moves, RED), moves), key=lambda pair: -pair[0])
+        candidates = []
+        for _, col in ranked:
+            child = board.copy()
+            make_move(child, col, RED)
+            if not check_winner(child, RED) and child.moves < board.geometry.cells:
+                candidates.append(child.to_payload())
+            if len(candidates) == PONDER_REPLIES:
+                break
+
+        difficulty = DIFFICULTIES[self.difficulty]
+        book_dir = get_opening_book_dir(client) if difficulty.book else None
+        scheduler = get_ai_scheduler(client)
+        for payload in candidates:
+            started = asyncio.Event()
+            search = asyncio.ensure_future(scheduler.run(
+                search_move, (payload, YELLOW, difficulty.engine, difficulty.depth, difficulty.endgame_cells, book_dir),
+                difficulty.time, ponder=True, on_start=started.set
+            ))
+            self.ponder_search = (payload, search, started)
+            try:
+                # Shielded so that take_ponder can stop this loop and still wait for the search
+                self.ponder_results[payload] = await asyncio.shield(search)
+            except (asyncio.TimeoutError, BrokenProcessPool):
+                # The search expired in the queue or its worker died, so pondering stops here
+                break
+            metrics.inc("ai_ponder_searches_total", game=self.KIND)
+        self.ponder_search = None
+
+    def stop_ponder(self, keep=None):
+        # Cancel pondering. The search of position keep, if it is the one running, is left to
+        # finish and returned. One still queued is cancelled like the others, as it would wait at
+        # ponder priority with no deadline while the human waits for the reply.
+        if self.ponder_task is not None:
+            self.ponder_task.cancel()
+            self.ponder_task = None
+        search, self.ponder_search = self.ponder_search, None
+        self.ponder_results = {}
+        if search is not None:
+            if search[0] == keep and search[2].is_set():
+                return search[1]
+            search[1].cancel()
+        return None
+
+    def take_ponder(self):
+        # Future of the AI reply pondered for the current position, finished or still running,
+        # or None when it was not pondered or its search had not started yet. Pondering of the
+        # other positions stops.
+        if self.ponder_task is None:
+            return None
+        payload = self.board.to_payload()
+        result = self.ponder_results.get(payload)
+        search = self.stop_ponder(keep=payload)
+        metrics.inc("ai_ponder_total", game=self.KIND, result="miss" if result is None and search is None else "hit")
+        if result is not None:
+            search = asyncio.get_running_loop().create_future()
+            search.set_result(result)
+        return search
+
+    async def make_move(self, interaction: discord.Interaction, col):
         # Handle player moves and update the board
-        async def callback(interaction: discord.Interaction):
-            player_emoji = self.player_emojis[self.current_turn]
+        if interaction.user.id != self.player_ids[self.current]:
+            await interaction.response.send_message("It's not your turn!", ephemeral=True)
+            return
 
-            if interaction.user != self.current_turn:
-                await interaction.response.send_message("It's not your turn!", ephemeral=True)
-                return
+        if not is_valid_move(self.board, col):
+            await interaction.response.send_message("This column is full. Choose another one.", ephemeral=True)
+            return
 
-            if not is_valid_move(self.board, col):
-                await interaction.response.send_message("This column is full. Choose another one.", ephemeral=True)
-                return
+        player = self.current
+        make_move(self.board, col, player)
+        self.last_move_col = col
+        self.moves.append(col)
+        editor = get_message_editor(interaction.client)
 
-            make_move(self.board, col, player_emoji)
-            self.last_move_col = col
-
-            # Update board and check for a winning move
-            if check_winner(self.board, player_emoji):
-                embed = discord.Embed(
-                    title=f"{self.player1.name} vs {self.player2.name}",
-                    description=f"{board_to_string(self.board, self.last_move_col)}\n\n**Winner:** {self.current_turn.mention}",
-                    color=discord.Color.red() if self.current_turn == self.player1 else discord.Color.yellow()
-                )
-                await interaction.response.edit_message(embed=embed, view=None)
-                self.stop()
-            else:
-                # Switch turn and update display
-                self.current_turn = self.player2 if self.current_turn == self.player1 else self.player1
-                current_color = discord.Color.red() if self.current_turn == self.player1 else discord.Color.yellow()
-                embed = discord.Embed(
-                    title=f"{self.player1.name} vs {self.player2.name}",
-                    description=f"{board_to_string(self.board, self.last_move_col)}\n\n**Current turn:** {self.current_turn.mention}",
-                    color=current_color
-                )
-                await interaction.response.edit_message(embed=embed, view=self)
-
-                # If AI is active, make AI move
-                if self.is_ai and self.current_turn == self.player2:
-                    await self.make_ai_move(interaction)
-        return callback
+        # Update board and check for a winning move
+        if check_winner(self.board, player):
+            editor.submit(interaction, **self.render(interaction.client, f"**Winner:** {self.mention(player)}", player, finished=True))
+            self.end_game(interaction.client, player)
+        elif self.board.moves == self.board.geometry.cells:
+            editor.submit(interaction, **self.render(interaction.client, "**It's a draw!**", player, finished=True))
+            self.end_game(interaction.client)
+        else:
+            # Switch turn; in AI games hold this render back so it can be replaced by the AI reply
+            self.current = 1 - player
+            ai_turn = self.is_ai and self.current == YELLOW
+            editor.submit(interaction, hold=AI_RENDER_HOLD if ai_turn else 0.0, **self.render_turn(interaction.client))
+
+            # If AI is active, make AI move
+            if ai_turn:
+                await self.make_ai_move(interaction)
+
+    def record_search(self, report):
+        # Export what the worker reported about one AI search
+        metrics.observe("ai_think_seconds", report.seconds, game=self.KIND)
+        metrics.observe("ai_nodes", report.nodes, buckets=NODE_BUCKETS, game=self.KIND)
+        metrics.inc("ai_nodes_total", report.nodes, game=self.KIND)
+        if report.book is not None:
+            metrics.inc("ai_book_total", game=self.KIND, result="hit" if report.book else "miss")
+        if report.endgame is not None:
+            solved, endgame_nodes = report.endgame
+            metrics.inc("ai_endgame_total", game=self.KIND, result="solved" if solved else "fallback")
+            metrics.observe("ai_endgame_nodes", endgame_nodes, buckets=NODE_BUCKETS, game=self.KIND)
+        if report.table is not None:
+            hits, misses, stores, overwrites = report.table
+            metrics.inc("ai_table_probes_total", hits, game=self.KIND, result="hit")
+            metrics.inc("ai_table_probes_total", misses, game=self.KIND, result="miss")
+            metrics.inc("ai_table_stores_total", stores, game=self.KIND)
+            metrics.inc("ai_table_overwrites_total", overwrites, game=self.KIND)
 
     async def make_ai_move(self, interaction: discord.Interaction):
-        # AI makes a move, updates the board, and checks for win
-        ai_emoji = self.player_emojis[self.player2]
-        col, _ = minimax(self.board, 4, -math.inf, math.inf, True, ai_emoji)
-        make_move(self.board, col, ai_emoji)
+        # AI makes a move, updates the board, and checks for win.
+        # A reply pondered while the human was thinking is ready at once; otherwise the search is
+        # queued behind the scheduler's quotas and should finish while the human move's render is
+        # still held back.
+        self.ai_future = self.take_ponder()
+        if self.ai_future is None:
+            difficulty = DIFFICULTIES[self.difficulty]
+            book_dir = get_opening_book_dir(interaction.client) if difficulty.book else None
+            scheduler = get_ai_scheduler(interaction.client)
+            self.ai_future = asyncio.ensure_future(scheduler.run(
+                search_move,
+                (self.board.to_payload(), YELLOW, difficulty.engine, difficulty.depth, difficulty.endgame_cells, book_dir),
+                difficulty.time,
+                guild_id=interaction.guild_id,
+                user_id=interaction.user.id,
+                deadline=scheduler.deadline_for(interaction, AI_RENDER_HOLD),
+                expires=scheduler.deadline_for(interaction, INTERACTION_TOKEN_WINDOW)
+            ))
+        future = self.ai_future
+        try:
+            # Shielded so that a cancellation of this handler can be told apart from the search
+            # being cancelled by the end of the game
+            report = await asyncio.shield(future)
+        except asyncio.TimeoutError:
+            return
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                future.cancel()
+                raise
+            return
+        finally:
+            self.ai_future = None
+        self.record_search(report)
+        if self.game_id not in get_session_registry(interaction.client).sessions:
+            return
+
+        col = report.move
+        make_move(self.board, col, YELLOW)
         self.last_move_col = col
+        self.moves.append(col)
+        editor = get_message_editor(interaction.client)
 
-        if check_winner(self.board, ai_emoji):
-            embed = discord.Embed(
-                title=f"{self.player1.name} vs {self.player2.name}",
-                description=f"{board_to_string(self.board, self.last_move_col)}\n\n**Winner:** {self.player2.mention}",
-                color=discord.Color.yellow()
-            )
-            await interaction.edit_original_response(embed=embed, view=None)
-            self.stop()
+        if check_winner(self.board, YELLOW):
+            editor.submit(interaction, **self.render(interaction.client, f"**Winner:** {self.mention(YELLOW)}", YELLOW, finished=True))
+            self.end_game(interaction.client, YELLOW)
+        elif self.board.moves == self.board.geometry.cells:
+            editor.submit(interaction, **self.render(interaction.client, "**It's a draw!**", YELLOW, finished=True))
+            self.end_game(interaction.client)
         else:
             # Switch turn to human player
-            self.current_turn = self.player1
-            embed = discord.Embed(
-                title=f"{self.player1.name} vs {self.player2.name}",
-                description=f"{board_to_string(self.board, self.last_move_col)}\n\n**Current turn:** {self.current_turn.mention}",
-                color=discord.Color.red()
-            )
-            await interaction.edit_original_response(embed=embed, view=self)
+            self.current = RED
+            editor.submit(interaction, **self.render_turn(interaction.client))
+            self.start_ponder(interaction.client)
+
+    def to_state(self):
+        return {
+            "players": list(self.player_ids),
+            "names": list(self.player_names),
+            "is_ai": self.is_ai,
+            "difficulty": self.difficulty,
+            "current": self.current,
+            "board": list(self.board.to_payload()),
+            "last_move_col": self.last_move_col,
+            "images": self.images,
+            "moves": self.moves,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        session = cls.__new__(cls)
+        session.player_ids = tuple(state["players"])
+        session.player_names = tuple(state["names"])
+        session.is_ai = state["is_ai"]
+        session.difficulty = state.get("difficulty", "normal")
+        session.current = state["current"]
+        session.board = Position.from_payload(state["board"])
+        session.last_move_col = state["last_move_col"]
+        session.ai_future = None
+        session.images = state.get("images", False)
+        session.ponder_task = None
+        session.ponder_search = None
+        session.ponder_results = {}
+        session.moves = state.get("moves", [])
+        return session
+
+def build_view(session):
+    # Buttons for each column and a forfeit button, at most 10 on the widest variant and laid out
+    # five to a row by discord.py. Presses are routed by the session registry, so the view is
+    # stopped right away and never kept by discord.py.
+    view = View(timeout=None)
+    for i in range(session.board.geometry.columns):
+        view.add_item(Button(label=str(i + 1), style=discord.ButtonStyle.blurple, custom_id=session.custom_id(i)))
+    view.add_item(Button(label="Forfeit", style=discord.ButtonStyle.danger, custom_id=session.custom_id("forfeit")))
+    view.stop()
+    return view
 
 class Connect4(commands.GroupCog, group_name='connect4'):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.sessions = get_session_registry(bot)
+        self.sessions.register(Connect4Session)
 
     # Command to start a new Connect 4 game
     @app_commands.command(description="Play Connect 4.")
-    @app_commands.describe(opponent="Opponent of the game")
-    async def play(self, interaction: discord.Interaction, opponent: discord.User = None):
+    @app_commands.describe(opponent="Opponent of the game", difficulty="How hard the AI plays",
+                           size="Board size, columns x rows", display="Draw the board as text or as an image")
+    async def play(self, interaction: discord.Interaction, opponent: discord.User = None,
+                   difficulty: Literal["easy", "normal", "hard"] = "normal",
+                   size: Literal["7x6", "8x7", "9x7"] = "7x6",
+                   display: Literal["text", "image"] = "text"):
         # Initialize opponent as AI if not specified or if player chooses themselves or the bot
         if opponent is None or opponent == interaction.user or opponent == self.bot.user:
             opponent = self.bot.user
@@ -215,16 +1188,14 @@ class Connect4(commands.GroupCog, group_name='connect4'):
         else:
             is_ai = False
 
-        # Initialize the game view and embed
-        view = Connect4View(player1=interaction.user, player2=opponent, is_ai=is_ai)
-        embed = discord.Embed(
-            title=f"{interaction.user.name} vs {opponent.name}",
-            description=f"{board_to_string(view.board)}\n\n**Current turn:** {view.current_turn.mention}",
-            color=discord.Color.red()
-        )
-
-        await interaction.response.send_message(embed=embed, view=view)
-        view.message = await interaction.original_response()
+        # Register the game session and show the empty board
+        session = Connect4Session(player1=interaction.user, player2=opponent, is_ai=is_ai, difficulty=difficulty, size=size,
+                                  images=display == "image")
+        session.game_id = self.sessions.new_id()
+        self.sessions.add(session)
+        metrics.inc("games_started_total", game=Connect4Session.KIND)
+        await interaction.response.send_message(**await message_fields(session.render_turn(interaction.client)))
+        session.start_ponder(interaction.client)
 
 # Function to set up the Connect 4 Cog in the bot
 async def setup(bot):
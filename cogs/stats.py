@@ -0,0 +1,57 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+from typing import Literal
+from utils.game_log import get_game_log
+
+# Game choices of the commands and the kinds they are logged as
+GAME_KINDS = {"connect4": "c4", "tictactoe": "ttt"}
+GAME_TITLES = {"c4": "Connect 4", "ttt": "Tic-Tac-Toe"}
+
+# Stats Cog answering from the game log's in-memory index, without touching the disk
+class Stats(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    # Command to show a player's record in one game
+    @app_commands.command(description="Show a player's wins, losses and draws.")
+    @app_commands.describe(game="Game to show the record of", user="Player to look up, yourself by default")
+    async def stats(self, interaction: discord.Interaction, game: Literal["connect4", "tictactoe"] = "connect4",
+                    user: discord.User = None):
+        user = user or interaction.user
+        kind = GAME_KINDS[game]
+        record = get_game_log(self.bot).index.player(kind, user.id)
+        if record is None:
+            await interaction.response.send_message(f"{user.name} has not finished a game of {GAME_TITLES[kind]} yet.", ephemeral=True)
+            return
+
+        embed = discord.Embed(title=f"{GAME_TITLES[kind]} record of {user.name}", color=0x3dbbe3)
+        embed.add_field(name="Games", value=str(record.games))
+        embed.add_field(name="Wins", value=str(record.wins))
+        embed.add_field(name="Losses", value=str(record.losses))
+        embed.add_field(name="Draws", value=str(record.draws))
+        embed.add_field(name="Win rate", value=f"{record.wins / record.games:.0%}")
+        await interaction.response.send_message(embed=embed)
+
+    # Command to show the players with the most wins in one game
+    @app_commands.command(description="Show the players with the most wins.")
+    @app_commands.describe(game="Game to show the leaderboard of")
+    async def leaderboard(self, interaction: discord.Interaction, game: Literal["connect4", "tictactoe"] = "connect4"):
+        kind = GAME_KINDS[game]
+        index = get_game_log(self.bot).index
+        leaders = index.leaderboard(kind)
+        if not leaders:
+            await interaction.response.send_message(f"Nobody has won a game of {GAME_TITLES[kind]} yet.", ephemeral=True)
+            return
+
+        lines = [
+            f"**{rank}.** <@{user_id}> · {record.wins} win{'s' if record.wins != 1 else ''} in {record.games} game{'s' if record.games != 1 else ''}"
+            for rank, (user_id, record) in enumerate(leaders, start=1)
+        ]
+        embed = discord.Embed(title=f"{GAME_TITLES[kind]} leaderboard", description="\n".join(lines), color=0x3dbbe3)
+        embed.set_footer(text=f"{index.games[kind]} games played")
+        await interaction.response.send_message(embed=embed)
+
+# Function to set up the Stats Cog in the bot
+async def setup(bot):
+    await bot.add_cog(Stats(bot))
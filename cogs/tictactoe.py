@@ -1,209 +1,535 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from discord.ui import Button, View
-import numpy as np
+from discord.ui import Button, Select, View
+import asyncio
+import random
+import time
+from typing import Literal
+from utils.ai_scheduler import INTERACTION_TOKEN_WINDOW, get_ai_scheduler
+from utils.engines import Engine, MCTSEngine, Rules, SearchBudget, SearchResult
+from utils.board_images import get_board_renderer
+from utils.game_log import AI_GAME, DRAW, get_game_log
+from utils.message_editor import get_message_editor, message_fields
+from utils.sessions import GameSession, get_session_registry
+from utils.metrics import metrics, NODE_BUCKETS
 
 # Define custom emojis for Tic-Tac-Toe symbols
 DASH_EMOJI = "<:dash:1280895467562995804>"
 CIRCLE_EMOJI = "<:circle:1280884553233334395>"
 CROSS_EMOJI = "<:cross:1280884530558795786>"
+# Plain emojis of boards drawn as text, where the custom ones would not fit in a message
+TEXT_EMOJIS = ("⬜", "❌", "⭕")
+ROW_LABELS = "ABCDEFGHI"
+COLUMN_EMOJIS = ("1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣")
 
-# Function to create an empty Tic-Tac-Toe board
-def create_board():
-    return np.zeros((3, 3), dtype=int)
+# Board sizes offered by the play command: name -> (cells per side, cells in a row needed to win)
+VARIANTS = {
+    "3x3": (3, 3),
+    "5x5": (5, 4),
+    "7x7": (7, 5),
+    "9x9": (9, 5),
+}
+# Discord allows 25 components per message, so larger boards are drawn as text or an image and
+# played by picking a row and a column from two select menus
+MAX_BUTTONS = 25
+
+# Seconds of MCTS search per difficulty tier on boards too large for the perfect-play table
+AI_TIME_BUDGETS = {
+    "easy": 0.25,
+    "normal": 1.0,
+    "hard": 1.5,
+}
+# How long the human move's render waits for the AI reply so both go out in one edit
+AI_RENDER_HOLD = 2.0
+
+# Cell (i, j) is bit i * 3 + j of a player's 9-bit mask
+FULL_MASK = 0b111111111
+LINE_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,  # rows
+    0b001001001, 0b010010010, 0b100100100,  # columns
+    0b100010001, 0b001010100                # diagonals
+)
+
+# Function to create an empty Tic-Tac-Toe board (0 = empty, 1 = cross, 2 = circle)
+def create_board(size=3):
+    return [[0] * size for _ in range(size)]
+
+# Function to encode a 3x3 board as one 9-bit mask per player
+def encode(board):
+    cross = circle = 0
+    for i in range(3):
+        for j in range(3):
+            if board[i][j] == 1:
+                cross |= 1 << (i * 3 + j)
+            elif board[i][j] == 2:
+                circle |= 1 << (i * 3 + j)
+    return cross, circle
+
+# Function to check whether a player's mask contains a complete line
+def has_line(mask):
+    for line in LINE_MASKS:
+        if mask & line == line:
+            return True
+    return False
 
 # Function to check if the board is full (i.e., no more moves are possible)
 def is_board_full(board):
-    return np.all(board != 0)
+    return all(all(row) for row in board)
+
+# Function to check whether the piece at (row, col) completes k in a row
+# Only the four lines through the last move are walked, so the cost does not grow with the board
+def is_winning_move(board, row, col, k):
+    size = len(board)
+    player = board[row][col]
+    for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        count = 1
+        for sign in (1, -1):
+            r, c = row + sign * d_row, col + sign * d_col
+            while 0 <= r < size and 0 <= c < size and board[r][c] == player:
+                count += 1
+                r, c = r + sign * d_row, c + sign * d_col
+        if count >= k:
+            return True
+    return False
+
+# Function to draw a board as text, with row letters and column numbers for the select menus
+def board_to_string(board):
+    header = "⬛" + "".join(COLUMN_EMOJIS[:len(board)])
+    rows = [f"{ROW_LABELS[i]} " + "".join(TEXT_EMOJIS[cell] for cell in row) for i, row in enumerate(board)]
+    return "\n".join([header, *rows])
+
+# Tiles of the cell values in board images
+TILE_NAMES = ("ttt:dash", "ttt:cross", "ttt:circle")
+
+# Function to lay out the tiles of a board image: column numbers on top and a row letter per row
+def board_to_grid(board):
+    grid = [["blank"] + [f"label:{col + 1}" for col in range(len(board))]]
+    for i, row in enumerate(board):
+        grid.append([f"label:{ROW_LABELS[i]}"] + [TILE_NAMES[cell] for cell in row])
+    return grid
 
 # Function to evaluate the current board state
 # Returns 1 if player 1 (cross) wins, 2 if player 2 (circle) wins, -1 for a tie, and 0 for an ongoing game
 def evaluate(board):
-    for player in [1, 2]:
-        if np.any(np.all(board == player, axis=0)) or \
-           np.any(np.all(board == player, axis=1)) or \
-           np.all(np.diag(board) == player) or \
-           np.all(np.diag(np.fliplr(board)) == player):
-            return player
-    if is_board_full(board):
+    return evaluate_masks(*encode(board))
+
+def evaluate_masks(cross, circle):
+    if has_line(cross):
+        return 1
+    if has_line(circle):
+        return 2
+    if cross | circle == FULL_MASK:
         return -1
     return 0
 
-# Minimax algorithm with alpha-beta pruning to determine the best move for the AI
-# The algorithm evaluates possible moves and chooses the optimal one for the AI
-def minimax(board, depth, maximizing_player, alpha, beta):
-    winner = evaluate(board)
-    if winner != 0:
-        if winner == -1:    # If it's a tie
-            return 0
-        elif maximizing_player:
-            return winner * (depth + 1)
+# Negamax over every reachable position, filling the best move of each unfinished one into moves
+# Scores are from the side to move: quicker wins and slower losses score higher
+def solve(cross, circle, moves, scores):
+    key = cross | circle << 9
+    if key in scores:
+        return scores[key]
+    if evaluate_masks(cross, circle) != 0:
+        # The previous move ended the game, so the side to move has lost or drawn
+        score = 0 if evaluate_masks(cross, circle) == -1 else -(10 - bin(cross | circle).count("1"))
+        scores[key] = score
+        return score
+
+    cross_to_move = bin(cross).count("1") == bin(circle).count("1")
+    best_score, best_cell = None, None
+    for cell in range(9):
+        bit = 1 << cell
+        if (cross | circle) & bit:
+            continue
+        if cross_to_move:
+            score = -solve(cross | bit, circle, moves, scores)
         else:
-            return winner * (depth + 1)
-
-    if maximizing_player:
-        max_eval = -np.inf
-        for i in range(3):
-            for j in range(3):
-                if board[i][j] == 0:
-                    board[i][j] = 2
-                    eval = minimax(board, depth + 1, False, alpha, beta)
-                    board[i][j] = 0             # undo move to evaluate other board places
-                    max_eval = max(max_eval, eval)
-                    alpha = max(alpha, eval)    # Alpha Beta Pruning
-                    if beta <= alpha:
-                        break
-                if beta <= alpha:
-                        break
-        return max_eval
-    else:
-        min_eval = np.inf
-        for i in range(3):
-            for j in range(3):
-                if board[i][j] == 0:
-                    board[i][j] = 1
-                    eval = minimax(board, depth + 1, True, alpha, beta)
-                    board[i][j] = 0         # undo move to evaluate other board places
-                    min_eval = min(min_eval, eval)
-                    beta = min(beta, eval)  # Alpha Beta Pruning
-                    if beta <= alpha:
-                        break
-                if beta <= alpha:
-                        break
-        return min_eval
-
-# Function to find the best possible move for the AI using the minimax algorithm
+            score = -solve(cross, circle | bit, moves, scores)
+        if best_score is None or score > best_score:
+            best_score, best_cell = score, cell
+    moves[key] = best_cell
+    scores[key] = best_score
+    return best_score
+
+# Perfect-play lookup table: key (cross mask | circle mask << 9) -> best cell for the side to move
+# All 5,478 reachable positions are enumerated once at import
+BEST_MOVES = {}
+solve(0, 0, BEST_MOVES, {})
+
+# Function to find the best possible move for the side to move on a 3x3 board with a table lookup
 def find_best_move(board):
-    best_val = -np.inf
-    best_move = None
-    alpha = -np.inf
-    beta = np.inf
-    for i in range(3):
-        for j in range(3):
-            if board[i][j] == 0:
-                board[i][j] = 2
-                move_val = minimax(board, 0, False, alpha, beta)
-                board[i][j] = 0
-                if move_val > best_val:
-                    best_val = move_val
-                    best_move = (i, j)
-    return best_move
+    cross, circle = encode(board)
+    cell = BEST_MOVES.get(cross | circle << 9)
+    if cell is None:
+        return None
+    return divmod(cell, 3)
+
+# Engine playing from the perfect-play table, with a chance of a random cell instead of the best one
+# The lookup costs nothing, so on 3x3 the tiers cannot map to compute budgets like they do on larger
+# boards and in Connect 4
+class TableEngine(Engine):
+    name = "table"
+
+    def __init__(self, mistake_rate=0.0):
+        self.mistake_rate = mistake_rate
+
+    def search(self, board, player, budget):
+        if random.random() < self.mistake_rate:
+            empty = [(i, j) for i in range(3) for j in range(3) if board[i][j] == 0]
+            return SearchResult(random.choice(empty) if empty else None, nodes=1)
+        return SearchResult(find_best_move(board), nodes=1)
+
+# AI engine of each difficulty tier on 3x3 boards, by its chance of a mistake. Only easy makes
+# any, so the default tier keeps the perfect play the bot always had on 3x3
+ENGINES = {
+    "easy": TableEngine(0.5),
+    "normal": TableEngine(0.0),
+    "hard": TableEngine(0.0),
+}
+
+# Rules of an N x N, k-in-a-row variant for the MCTS engine used on larger boards
+# Moves are the empty cells next to a piece, since play far from every piece is rarely useful
+# on large boards, and playouts fill the remaining cells in random order
+class TicTacToeRules(Rules):
+    def __init__(self, k):
+        self.k = k
+
+    def moves(self, board):
+        size = len(board)
+        if size <= 3:
+            return [(i, j) for i in range(size) for j in range(size) if board[i][j] == 0]
+        moves = []
+        for i in range(size):
+            for j in range(size):
+                if board[i][j] == 0 and any(
+                    board[r][c] for r in range(max(i - 1, 0), min(i + 2, size)) for c in range(max(j - 1, 0), min(j + 2, size))
+                ):
+                    moves.append((i, j))
+        if not moves and not is_board_full(board):
+            moves.append((size // 2, size // 2))
+        return moves
+
+    def play(self, board, move, player):
+        board[move[0]][move[1]] = player
+
+    def won(self, board, move, player):
+        return is_winning_move(board, move[0], move[1], self.k)
+
+    def full(self, board):
+        return is_board_full(board)
+
+    def other(self, player):
+        return 3 - player
+
+    def copy(self, board):
+        return [row[:] for row in board]
+
+    def key(self, board):
+        return tuple(map(tuple, board))
+
+    def rollout(self, board, player, rng, budget):
+        empty = [(i, j) for i, row in enumerate(board) for j, cell in enumerate(row) if cell == 0]
+        rng.shuffle(empty)
+        for row, col in empty:
+            budget.tick()
+            board[row][col] = player
+            if is_winning_move(board, row, col, self.k):
+                return player
+            player = 3 - player
+        return None
+
+# MCTS engines of the current process, one per variant so kept trees are only looked up for
+# boards of the same size
+_engines = {}
+
+# Entry point for AI searches on large boards, run through the AI service
+# Returns ((row, col), nodes searched, seconds spent) so the caller can record the search
+def search_move(variant, board, player, time_budget):
+    start = time.perf_counter()
+    engine = _engines.get(variant)
+    if engine is None:
+        engine = _engines[variant] = MCTSEngine(TicTacToeRules(VARIANTS[variant][1]))
+    result = engine.search(board, player, SearchBudget(time_budget))
+    return result.move, result.nodes, time.perf_counter() - start
 
 # Button class for each Tic-Tac-Toe cell
-# Inherits from discord.ui.Button and handles the interaction for a specific cell
+# Shows the cell's symbol; presses are routed to the game session by the session registry
 class TicTacToeButton(Button):
-    def __init__(self, row: int, col: int):
-        super().__init__(emoji=DASH_EMOJI, style=discord.ButtonStyle.secondary, row=row)
+    def __init__(self, row: int, col: int, value: int, custom_id: str, disabled=False):
+        if value == 1:
+            emoji, style = CROSS_EMOJI, discord.ButtonStyle.danger
+        elif value == 2:
+            emoji, style = CIRCLE_EMOJI, discord.ButtonStyle.success
+        else:
+            emoji, style = DASH_EMOJI, discord.ButtonStyle.secondary
+        super().__init__(emoji=emoji, style=style, row=row, custom_id=custom_id, disabled=disabled or value != 0)
         self.row = row
         self.col = col
 
-    # Callback method for when a button is clicked
-    async def callback(self, interaction: discord.Interaction):
-        view: TicTacToeView = self.view
-        if view.current_turn != interaction.user and not view.is_ai_turn:
-            await interaction.response.send_message("It's not your turn!", ephemeral=True)
-            return
+# Session class holding the state of one Tic-Tac-Toe game
+# A compact record instead of a View: the buttons are rebuilt from the board on every render
+class TicTacToeSession(GameSession):
+    KIND = "ttt"
+    __slots__ = (
+        "player_ids", "player_names", "is_ai", "difficulty", "variant", "current", "board", "title", "finished",
+        "pending", "ai_future", "images", "moves"
+    )
 
-        # Update button to the current player's emoji and disable it
-        self.emoji = view.current_emoji_turn
-        self.style = discord.ButtonStyle.danger if view.current_emoji_turn == CROSS_EMOJI else discord.ButtonStyle.success
-        self.disabled = True
-        view.board[self.row][self.col] = 1 if view.current_emoji_turn == CROSS_EMOJI else 2
-        await interaction.response.edit_message(view=view)
-
-        # Check for a win or a draw
-        if view.check_winner():
-            await interaction.followup.send(f"{interaction.user.name} wins!")
-            view.disable_all_buttons()
-            await interaction.edit_original_response(view=view)
-        elif view.is_draw():
-            await interaction.followup.send("It's a draw!")
-            view.disable_all_buttons()
-            await interaction.edit_original_response(view=view)
-        else:
-            # Alternate the turn to the other player and change the emoji
-            view.current_turn = view.player2 if view.current_turn == view.player1 else view.player1
-            view.current_emoji_turn = CIRCLE_EMOJI if view.current_emoji_turn == CROSS_EMOJI else CROSS_EMOJI
-
-            # If the AI is playing, make the AI move
-            if view.is_ai_turn:
-                await view.make_ai_move(interaction)
-
-# View class to manage the Tic-Tac-Toe game board and player turns
-# Inherits from discord.ui.View and manages the overall game state
-class TicTacToeView(View):
-    def __init__(self, player1: discord.User, player2: discord.User, is_ai=False):
-        super().__init__(timeout=300)
-        self.player1 = player1
-        self.player2 = player2
-        self.is_ai_turn = is_ai
-        self.current_turn = player1
-        self.current_emoji_turn = CROSS_EMOJI
-        self.board = create_board()
-
-        # Add buttons to the view, representing the Tic-Tac-Toe grid
-        for row in range(3):
-            for col in range(3):
-                button = TicTacToeButton(row=row, col=col)
-                self.add_item(button)
-
-    # Check if there's a winner based on the current board state
-    def check_winner(self):
-        winner = evaluate(self.board)
-        return winner != 0
+    def __init__(self, player1: discord.User, player2: discord.User, is_ai=False, difficulty="normal", variant="3x3",
+                 images=False):
+        self.player_ids = (player1.id, player2.id)
+        self.player_names = (player1.name, player2.name)
+        self.is_ai = is_ai
+        self.difficulty = difficulty
+        self.variant = variant
+        self.current = 0
+        self.board = create_board(VARIANTS[variant][0])
+        self.title = self.make_title()
+        self.finished = False
+        self.pending = [None, None]
+        self.ai_future = None
+        self.images = images
+        # Cells played so far as row * size + column, for the game log
+        self.moves = []
+
+    def make_title(self):
+        size, k = VARIANTS[self.variant]
+        title = f"The following is the game between {self.player_names[0]} and {self.player_names[1]}"
+        return title if size == 3 else f"{title} on {self.variant}, {k} in a row to win"
+
+    # Whether the board is drawn as text with select menus instead of one button per cell
+    def uses_selects(self):
+        return len(self.board) ** 2 > MAX_BUTTONS
+
+    # Check if the piece just placed at (row, col) wins the game
+    def check_winner(self, row, col):
+        return is_winning_move(self.board, row, col, VARIANTS[self.variant][1])
 
     # Check if the game is a draw (i.e., no more moves possible and no winner)
     def is_draw(self):
         return is_board_full(self.board)
 
-    # Disable all buttons in the view after the game ends
-    def disable_all_buttons(self):
-        for item in self.children:
-            item.disabled = True
+    # Build the grid of buttons for the current board, or the row and column menus of a large one
+    def build_view(self):
+        view = View(timeout=None)
+        size = len(self.board)
+        if not self.uses_selects():
+            for row in range(size):
+                for col in range(size):
+                    view.add_item(TicTacToeButton(row, col, self.board[row][col], self.custom_id(f"{row}{col}"), self.finished))
+        else:
+            pending_row, pending_col = self.pending
+            rows = [row for row in range(size) if 0 in self.board[row]]
+            if pending_row is None:
+                cols = [col for col in range(size) if any(self.board[row][col] == 0 for row in range(size))]
+            else:
+                cols = [col for col in range(size) if self.board[pending_row][col] == 0]
+            view.add_item(Select(custom_id=self.custom_id("row"), placeholder="Row", disabled=self.finished, options=[
+                discord.SelectOption(label=ROW_LABELS[row], value=str(row), default=row == pending_row) for row in rows
+            ]))
+            view.add_item(Select(custom_id=self.custom_id("col"), placeholder="Column", disabled=self.finished, options=[
+                discord.SelectOption(label=str(col + 1), value=str(col), default=col == pending_col) for col in cols
+            ]))
+        view.stop()
+        return view
+
+    # Message content and buttons, with the result appended once the game is over. Large boards
+    # in image mode are a PNG attachment drawn off the event loop, which the message editor waits
+    # for when it sends the render.
+    def render(self, client, result=None):
+        if not self.uses_selects():
+            if result is None:
+                return {"view": self.build_view()}
+            return {"content": f"{self.title}\n\n**{result}**", "view": self.build_view()}
+        status = f"**{result}**" if result is not None else f"**Current turn:** <@{self.player_ids[self.current]}>"
+        view = None if self.finished else self.build_view()
+        if self.images:
+            key = (self.KIND, tuple(map(tuple, self.board)))
+            png = get_board_renderer(client).render(key, board_to_grid(self.board))
+            return {"content": f"{self.title}\n\n{status}", "attachments": [("board.png", png)], "view": view}
+        return {"content": f"{self.title}\n{board_to_string(self.board)}\n\n{status}", "view": view}
+
+    # End the game: disable the board, unregister the session and log the game, won by the
+    # player with index winner or drawn when it is None
+    def end_game(self, client, winner=None):
+        self.finished = True
+        get_session_registry(client).remove(self)
+        self.expire()
+        get_game_log(client).record(
+            self.KIND, self.variant, DRAW if winner is None else winner, AI_GAME if self.is_ai else 0,
+            self.player_ids, self.moves
+        )
+
+    def expire(self):
+        if self.ai_future is not None:
+            self.ai_future.cancel()
+
+    # Handle a press on cell "<row><col>", or a pick from the "row" or "col" menu
+    async def dispatch(self, interaction: discord.Interaction, action: str):
+        if self.is_ai and self.current == 1 and self.ai_future is None and interaction.user.id == self.player_ids[0]:
+            # A restart interrupted the AI's reply; any press resumes it
+            await self.make_ai_move(interaction)
+            return
+        if interaction.user.id != self.player_ids[self.current]:
+            await interaction.response.send_message("It's not your turn!", ephemeral=True)
+            return
+
+        if action in ("row", "col"):
+            # The menus pick one coordinate at a time and the move is made once both are known
+            self.pending[0 if action == "row" else 1] = int(interaction.data["values"][0])
+            row, col = self.pending
+            if row is not None and col is not None and self.board[row][col] != 0:
+                # The column picked first is taken in this row, so ask for it again
+                self.pending[1] = col = None
+            if row is None or col is None:
+                get_message_editor(interaction.client).submit(interaction, **self.render(interaction.client))
+                return
+        else:
+            row, col = int(action[0]), int(action[1])
+        if self.board[row][col] != 0:
+            await interaction.response.send_message("This cell is already taken.", ephemeral=True)
+            return
 
-    # AI makes its move based on the best possible outcome using minimax
+        self.pending = [None, None]
+        self.board[row][col] = self.current + 1
+        self.moves.append(row * len(self.board) + col)
+        editor = get_message_editor(interaction.client)
+
+        # Check for a win or a draw, announcing the result in the final edit
+        if self.check_winner(row, col):
+            self.end_game(interaction.client, self.current)
+            editor.submit(interaction, **self.render(interaction.client, f"{interaction.user.name} wins!"))
+        elif self.is_draw():
+            self.end_game(interaction.client)
+            editor.submit(interaction, **self.render(interaction.client, "It's a draw!"))
+        else:
+            # Alternate the turn to the other player
+            self.current = 1 - self.current
+            ai_turn = self.is_ai and self.uses_search()
+            editor.submit(interaction, hold=AI_RENDER_HOLD if ai_turn else 0.0, **self.render(interaction.client))
+
+            # If the AI is playing, make the AI move; its render replaces the one above
+            if self.is_ai:
+                await self.make_ai_move(interaction)
+
+    # Whether the AI searches with MCTS through the AI service instead of the 3x3 table
+    def uses_search(self):
+        return len(self.board) > 3
+
+    # AI makes its move with the engine of the difficulty tier: a lookup in the perfect-play table
+    # on 3x3, which runs inline, or an MCTS search queued on the AI scheduler on larger boards
     async def make_ai_move(self, interaction: discord.Interaction):
-        best_move = find_best_move(self.board)
+        if not self.uses_search():
+            start = time.perf_counter()
+            best_move = ENGINES[self.difficulty].search(self.board, 2, SearchBudget()).move
+            metrics.observe("ai_think_seconds", time.perf_counter() - start, game=self.KIND)
+        else:
+            scheduler = get_ai_scheduler(interaction.client)
+            self.ai_future = asyncio.ensure_future(scheduler.run(
+                search_move, (self.variant, self.board, 2), AI_TIME_BUDGETS[self.difficulty],
+                guild_id=interaction.guild_id,
+                user_id=interaction.user.id,
+                deadline=scheduler.deadline_for(interaction, AI_RENDER_HOLD),
+                expires=scheduler.deadline_for(interaction, INTERACTION_TOKEN_WINDOW)
+            ))
+            future = self.ai_future
+            try:
+                # Shielded so that a cancellation of this handler can be told apart from the search
+                # being cancelled by the end of the game
+                best_move, nodes, seconds = await asyncio.shield(future)
+            except asyncio.TimeoutError:
+                return
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    future.cancel()
+                    raise
+                return
+            finally:
+                self.ai_future = None
+            metrics.observe("ai_think_seconds", seconds, game=self.KIND)
+            metrics.observe("ai_nodes", nodes, buckets=NODE_BUCKETS, game=self.KIND)
+            metrics.inc("ai_nodes_total", nodes, game=self.KIND)
+            if self.game_id not in get_session_registry(interaction.client).sessions:
+                return
+
         if best_move:
             row, col = best_move
-            button = self.children[row * 3 + col]
-            button.emoji = CIRCLE_EMOJI
-            button.style = discord.ButtonStyle.success
-            button.disabled = True
             self.board[row][col] = 2
-            await interaction.edit_original_response(view=self)
+            self.moves.append(row * len(self.board) + col)
+            editor = get_message_editor(interaction.client)
 
-            if self.check_winner():
-                await interaction.followup.send(f"Miini-Games wins!")
-                self.disable_all_buttons()
-                await interaction.edit_original_response(view=self)
+            if self.check_winner(row, col):
+                self.end_game(interaction.client, 1)
+                editor.submit(interaction, **self.render(interaction.client, "Miini-Games wins!"))
             elif self.is_draw():
-                await interaction.followup.send("It's a draw!")
-                self.disable_all_buttons()
-                await interaction.edit_original_response(view=self)
+                self.end_game(interaction.client)
+                editor.submit(interaction, **self.render(interaction.client, "It's a draw!"))
             else:
-                self.current_turn = self.player1
-                self.current_emoji_turn = CROSS_EMOJI
+                self.current = 0
+                editor.submit(interaction, **self.render(interaction.client))
+
+    def to_state(self):
+        return {
+            "players": list(self.player_ids),
+            "names": list(self.player_names),
+            "is_ai": self.is_ai,
+            "difficulty": self.difficulty,
+            "variant": self.variant,
+            "current": self.current,
+            "board": self.board,
+            "images": self.images,
+            "moves": self.moves,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        session = cls.__new__(cls)
+        session.player_ids = tuple(state["players"])
+        session.player_names = tuple(state["names"])
+        session.is_ai = state["is_ai"]
+        session.difficulty = state.get("difficulty", "normal")
+        session.variant = state.get("variant", "3x3")
+        session.current = state["current"]
+        session.board = state["board"]
+        session.title = session.make_title()
+        session.finished = False
+        session.pending = [None, None]
+        session.ai_future = None
+        session.images = state.get("images", False)
+        session.moves = state.get("moves", [])
+        return session
 
 # TicTacToe Cog to manage the Tic-Tac-Toe commands
 class TicTacToe(commands.GroupCog, group_name='tictactoe'):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.sessions = get_session_registry(bot)
+        self.sessions.register(TicTacToeSession)
 
     # Command to start a Tic-Tac-Toe game
     @app_commands.command(description="Play Tic-Tac-Toe.")
-    @app_commands.describe(opponent="Opponent of the game")
-    async def play(self, interaction: discord.Interaction, opponent: discord.User = None):
+    @app_commands.describe(opponent="Opponent of the game", difficulty="How hard the AI plays",
+                           size="Board size; larger boards need more in a row to win",
+                           display="Draw boards too large for buttons as text or as an image")
+    async def play(self, interaction: discord.Interaction, opponent: discord.User = None,
+                   difficulty: Literal["easy", "normal", "hard"] = "normal",
+                   size: Literal["3x3", "5x5", "7x7", "9x9"] = "3x3",
+                   display: Literal["text", "image"] = "text"):
         if opponent is None:
             opponent = self.bot.user  # Bot will be the default opponent
             is_ai = True
         else:
             is_ai = False
 
-        # Initialize the TicTacToeView with players and start the game
-        view = TicTacToeView(player1=interaction.user, player2=opponent, is_ai=is_ai)
-        await interaction.response.send_message(f"The following is the game between {interaction.user.name} and {opponent.name}", view=view)
+        # Register the game session and start the game
+        session = TicTacToeSession(player1=interaction.user, player2=opponent, is_ai=is_ai, difficulty=difficulty, variant=size,
+                                   images=display == "image")
+        session.game_id = self.sessions.new_id()
+        self.sessions.add(session)
+        metrics.inc("games_started_total", game=TicTacToeSession.KIND)
+        render = session.render(interaction.client)
+        render.setdefault("content", session.title)
+        await interaction.response.send_message(**await message_fields(render))
 
 # Function to set up the TicTacToe Cog in the bot
 async def setup(bot):
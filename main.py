@@ -1,44 +1,225 @@
+import time
+START_TIME = time.perf_counter()
+
 import discord
 from discord.ext import commands
-from discord.ui import View
+import asyncio
+import hashlib
+import json
 import os
 from dotenv import load_dotenv, find_dotenv
+from utils.ai_service import AIService
+from utils.ai_scheduler import AIScheduler
+from utils.board_images import BoardRenderer
+from utils.cluster import ClusterClient, connect_stand_in
+from utils.game_log import GameLog
+from utils.message_editor import MessageEditor
+from utils.sessions import SessionRegistry
+from utils.metrics import metrics
 
 load_dotenv(find_dotenv())
 TOKEN = os.getenv('TOKEN')
+# Number of AI search worker processes, defaults to one per CPU core
+AI_WORKERS = os.getenv('AI_WORKERS')
+# File where running games are saved so they survive a restart
+SESSIONS_FILE = os.getenv('SESSIONS_FILE', 'sessions.json')
+# Directory of the append-only log of finished games behind /stats and /leaderboard
+GAME_LOG_DIR = os.getenv('GAME_LOG_DIR', 'games')
+# Directory of the Connect 4 opening books built by build_book.py
+OPENING_BOOK_DIR = os.getenv('OPENING_BOOK_DIR', 'books')
+# File holding the hash of the last command tree synced to Discord
+COMMAND_HASH_FILE = os.getenv('COMMAND_HASH_FILE', '.command_hash')
+# Local port of the Prometheus metrics endpoint and seconds between metrics log lines;
+# instrumentation stays disabled unless one of them is set
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_LOG_INTERVAL = os.getenv('METRICS_LOG_INTERVAL')
+# Concurrent AI searches allowed per guild and per user
+AI_GUILD_QUOTA = int(os.getenv('AI_GUILD_QUOTA', 4))
+AI_USER_QUOTA = int(os.getenv('AI_USER_QUOTA', 1))
+# Search slots that may be used to ponder replies while players think, defaults to half of them;
+# 0 disables pondering
+AI_PONDER_SLOTS = os.getenv('AI_PONDER_SLOTS')
+
+# Set by cluster.py when this process is one worker of a cluster: its cluster number, the shards
+# it runs out of SHARD_COUNT and the launcher's IPC port. A bot started directly runs every shard.
+CLUSTER_ID = os.getenv('CLUSTER_ID')
+SHARD_IDS = [int(shard) for shard in os.getenv('SHARD_IDS', '').split(',') if shard]
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+CLUSTER_IPC_PORT = os.getenv('CLUSTER_IPC_PORT')
+# Port of a local stand-in gateway (benchmarks.fake_gateway) to connect the shards to instead of
+# Discord, for checking cluster assignment and failover offline
+STAND_IN_GATEWAY = os.getenv('STAND_IN_GATEWAY')
+if CLUSTER_ID is not None:
+    # Every cluster saves its own games and serves metrics on its own port
+    root, ext = os.path.splitext(SESSIONS_FILE)
+    SESSIONS_FILE = f"{root}.{CLUSTER_ID}{ext}"
+    if METRICS_PORT:
+        METRICS_PORT = str(int(METRICS_PORT) + int(CLUSTER_ID))
+
+EXTENSIONS = [
+    "menu",
+    "tictactoe",
+    "connect4",
+    "stats"
+]
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.AutoShardedBot(command_prefix=">>", intents=intents)
+class MiniGamesBot(commands.AutoShardedBot):
+    def __init__(self):
+        super().__init__(command_prefix=">>", intents=intents, shard_ids=SHARD_IDS or None, shard_count=SHARD_COUNT)
+        self.ai_service = AIService(workers=int(AI_WORKERS) if AI_WORKERS else None)
+        self.ai_scheduler = AIScheduler(
+            self.ai_service, guild_quota=AI_GUILD_QUOTA, user_quota=AI_USER_QUOTA,
+            ponder_slots=int(AI_PONDER_SLOTS) if AI_PONDER_SLOTS else None
+        )
+        self.message_editor = MessageEditor()
+        self.board_renderer = BoardRenderer()
+        self.sessions = SessionRegistry(path=SESSIONS_FILE)
+        # Cluster workers share the log directory, each writing segments of its own
+        self.game_log = GameLog(path=GAME_LOG_DIR, prefix="games" if CLUSTER_ID is None else f"games-c{CLUSTER_ID}")
+        # Books are opened by the AI workers themselves, each mapping the same files
+        self.opening_book_dir = OPENING_BOOK_DIR
+        # Single dispatcher routing every game button press to its session
+        self.add_listener(self.sessions.dispatch, "on_interaction")
+        # Seconds spent in each startup phase, printed once the bot is first ready
+        self.startup_timings = {"import": time.perf_counter() - START_TIME}
+        self.ready_once = False
+        # IPC channel to the cluster launcher, in cluster workers only
+        self.cluster = None
+        self.stopped = asyncio.Event()
+
+    async def setup_hook(self):
+        # Runs once before connecting, unlike on_ready which fires again on every reconnect
+        await self.start_services()
+        await self.load_extensions()
+
+        # Only the first cluster syncs the command tree, which is shared by all of them
+        if CLUSTER_ID in (None, "0"):
+            phase_start = time.perf_counter()
+            await self.sync_commands()
+            self.startup_timings["sync"] = time.perf_counter() - phase_start
 
-@bot.event
-async def on_ready():
-    print(f"We have logged in as {bot.user}")
+    async def start_services(self):
+        # The game log index is rebuilt here so its time shows in the startup timings
+        phase_start = time.perf_counter()
+        self.game_log.open()
+        self.startup_timings["game log"] = time.perf_counter() - phase_start
+        if CLUSTER_IPC_PORT:
+            self.cluster = ClusterClient(int(CLUSTER_ID), int(CLUSTER_IPC_PORT), self.cluster_stats, self.close)
+            await self.cluster.start()
+        if METRICS_PORT or METRICS_LOG_INTERVAL:
+            metrics.add_collector(self.sessions.active_games)
+            metrics.add_collector(self.ai_scheduler.queue_depth)
+            if self.cluster is not None:
+                metrics.add_collector(self.cluster.cluster_stats)
+            await metrics.start(
+                port=int(METRICS_PORT) if METRICS_PORT else None,
+                log_interval=float(METRICS_LOG_INTERVAL) if METRICS_LOG_INTERVAL else None
+            )
 
-    await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.playing, name="games 🎮"))
-    
-    extensions = [
-        "menu",
-        "tictactoe",
-        "connect4"
-    ]
+    async def load_extensions(self):
+        phase_start = time.perf_counter()
+        for ext in EXTENSIONS:
+            try:
+                await self.load_extension(f"cogs.{ext}")
+                print(f"Loaded extension: {ext}")
+            except commands.ExtensionError as e:
+                print(f"Failed to load extension {ext}: {e}")
+        self.startup_timings["extension load"] = time.perf_counter() - phase_start
 
-    for ext in extensions:
+    def cluster_stats(self):
+        # This worker's share of the cluster-wide stats reported to the launcher
+        return {
+            "active_games": len(self.sessions.sessions),
+            "ai_queue_depth": len(self.ai_scheduler.queue),
+            "ai_running": self.ai_scheduler.running,
+            "shards": len(self.shards) if self.shards else len(SHARD_IDS),
+        }
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            # The IPC client is stopped last, as the launcher's stop request may be what called this
+            if self.cluster is not None:
+                self.cluster.stop()
+            self.stopped.set()
+
+    def command_tree_hash(self):
+        # Content hash of the application commands as they would be sent to Discord
+        payload = [command.to_dict() for command in self.tree.get_commands()]
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def sync_commands(self):
+        # Sync the command tree only if it changed since the last successful sync
+        tree_hash = self.command_tree_hash()
+        try:
+            with open(COMMAND_HASH_FILE) as f:
+                if f.read().strip() == tree_hash:
+                    print("Commands unchanged, skipping sync")
+                    return
+        except OSError:
+            pass
+
+        try:
+            synced = await self.tree.sync()
+            print(f"Synced {len(synced)} command(s)")
+        except Exception as e:
+            print(e)
+            return
+        with open(COMMAND_HASH_FILE, "w") as f:
+            f.write(tree_hash)
+
+    async def on_ready(self):
+        print(f"We have logged in as {self.user}")
+
+        await self.change_presence(activity=discord.Activity(type=discord.ActivityType.playing, name="games 🎮"))
+
+        if not self.ready_once:
+            self.ready_once = True
+            self.startup_timings["first ready"] = time.perf_counter() - START_TIME
+            print("Startup timings: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_timings.items()))
+            for phase, seconds in self.startup_timings.items():
+                metrics.set("startup_seconds", seconds, phase=phase)
+            if self.cluster is not None:
+                await self.cluster.ready()
+
+async def run_stand_in(bot):
+    # Run the cogs and the cluster IPC with the shards connected to a stand-in gateway
+    async with bot:
+        await bot.start_services()
+        await bot.load_extensions()
+        gateway = await connect_stand_in(SHARD_IDS, SHARD_COUNT, int(STAND_IN_GATEWAY), int(CLUSTER_ID or 0))
+        if bot.cluster is not None:
+            await bot.cluster.ready()
+        await bot.stopped.wait()
+        gateway.close()
+
+def shutdown(bot):
+    metrics.stop()
+    bot.sessions.stop()
+    bot.game_log.stop()
+    bot.ai_service.shutdown()
+    bot.board_renderer.shutdown()
+
+# AI worker processes re-import this module, so the bot is only built and run in the main process
+if __name__ == "__main__":
+    if STAND_IN_GATEWAY:
+        bot = MiniGamesBot()
+        bot.ai_service.start()
+        try:
+            asyncio.run(run_stand_in(bot))
+        finally:
+            shutdown(bot)
+    elif TOKEN is None:
+        print("Error: Discord bot TOKEN not found in the .env file.")
+    else:
+        bot = MiniGamesBot()
+        bot.ai_service.start()
         try:
-            await bot.load_extension(f"cogs.{ext}")
-            print(f"Loaded extension: {ext}")
-        except commands.ExtensionError as e:
-            print(f"Failed to load extension {ext}: {e}")
-
-    try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        print(e)
-
-if TOKEN is None:
-    print("Error: Discord bot TOKEN not found in the .env file.")
-else:
-    bot.run(TOKEN)
\ No newline at end of file
+            bot.run(TOKEN)
+        finally:
+            shutdown(bot)
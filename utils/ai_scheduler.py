@@ -0,0 +1,172 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import discord
+from utils.ai_service import get_ai_service
+from utils.metrics import metrics
+from utils.services import get_service
+
+# Discord invalidates an interaction token 15 minutes after the interaction was created
+INTERACTION_TOKEN_WINDOW = 15 * 60
+# Searches never get less than this many seconds, however overloaded the scheduler is
+MIN_BUDGET = 0.05
+# Margin kept between the end of a search and its deadline for the edit itself
+DEADLINE_MARGIN = 0.2
+
+class _Request:
+    __slots__ = ("ponder", "deadline", "expires", "seq", "guild_id", "user_id", "budget", "granted", "started")
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+class AIScheduler:
+    # Admission control in front of the AI service. Searches wait in a queue ordered by deadline
+    # (earliest first) and start when a search slot is free and neither their guild nor their
+    # user is over its quota of concurrent searches. When a search starts its time budget is cut
+    # to what its deadline still allows and shrunk further while the queue is backed up, so an
+    # overloaded bot plays weaker moves on time instead of timing out.
+    # Ponder searches, run speculatively while a player is thinking, wait in a queue of their own
+    # and have the lowest priority: they only start after every other search that can start, at
+    # most ponder_slots of them run at once, so the remaining slots always stay free for searches
+    # someone is waiting for, and they never count towards the backlog that shrinks budgets.
+
+    def __init__(self, service, slots=None, guild_quota=4, user_quota=1, ponder_slots=None):
+        self.service = service
+        self.slots = slots or max(service.workers, 1)
+        self.guild_quota = guild_quota
+        self.user_quota = user_quota
+        self.ponder_slots = self.slots // 2 if ponder_slots is None else min(ponder_slots, self.slots - 1)
+        self.queue = []
+        self.ponder_queue = []
+        self.running = 0
+        self.ponder_running = 0
+        self.guild_running = {}
+        self.user_running = {}
+        self.sequence = itertools.count()
+
+    def deadline_for(self, interaction: discord.Interaction, seconds):
+        # Loop time at which an interaction is `seconds` old
+        age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        return asyncio.get_running_loop().time() + seconds - age
+
+    async def run(self, fn, args, budget, guild_id=None, user_id=None, deadline=None, expires=None, ponder=False,
+                  on_start=None):
+        # Queue fn(*args, time_budget) and return its result once it has run. The budget passed
+        # to fn is at most `budget` seconds and ends before `deadline` when possible; requests
+        # still queued at `expires` raise asyncio.TimeoutError. Ponder requests always get their
+        # full budget and do not count against the guild and user quotas. on_start, if given, is
+        # called once the request leaves the queue to run.
+        loop = asyncio.get_running_loop()
+        request = _Request()
+        request.ponder = ponder
+        request.deadline = deadline if deadline is not None else loop.time() + budget
+        request.expires = expires if expires is not None else loop.time() + INTERACTION_TOKEN_WINDOW
+        request.seq = next(self.sequence)
+        request.guild_id = guild_id
+        request.user_id = user_id
+        request.budget = budget
+        request.granted = loop.create_future()
+        request.started = False
+        queue = self.ponder_queue if ponder else self.queue
+        heapq.heappush(queue, request)
+        self.pump()
+
+        try:
+            granted_budget = await request.granted
+        except asyncio.CancelledError:
+            if request in queue:
+                queue.remove(request)
+                heapq.heapify(queue)
+            elif request.started:
+                self.release(request)
+            raise
+
+        if on_start is not None:
+            on_start()
+        # The slot is released when the worker is done, not when this is cancelled, as a search
+        # already running keeps its worker busy until it ends
+        try:
+            future = self.service.submit(fn, *args, granted_budget, on_stopped=functools.partial(self.release, request))
+        except BaseException:
+            self.release(request)
+            raise
+        return await future
+
+    def admissible(self, request):
+        # Requests without a guild or a user are not held to that quota
+        return (
+            (request.guild_id is None or self.guild_running.get(request.guild_id, 0) < self.guild_quota)
+            and (request.user_id is None or self.user_running.get(request.user_id, 0) < self.user_quota)
+        )
+
+    def pump(self):
+        # Start queued requests while slots are free, earliest deadline first among those within
+        # quota, then ponder requests in the slots left over
+        loop = asyncio.get_running_loop()
+        blocked = []
+        while self.queue and self.running < self.slots:
+            request = heapq.heappop(self.queue)
+            if request.granted.done():
+                continue
+            if loop.time() >= request.expires:
+                request.granted.set_exception(asyncio.TimeoutError())
+                continue
+            if not self.admissible(request):
+                blocked.append(request)
+                continue
+
+            request.started = True
+            self.running += 1
+            # Shrink the budget while others are waiting and fit it before the deadline
+            budget = request.budget * self.slots / (self.slots + len(self.queue) + len(blocked))
+            budget = min(budget, request.deadline - loop.time() - DEADLINE_MARGIN)
+            budget = max(budget, MIN_BUDGET)
+            if budget < request.budget:
+                metrics.inc("ai_degraded_total")
+            metrics.observe("ai_budget_seconds", budget)
+
+            for counts, key in ((self.guild_running, request.guild_id), (self.user_running, request.user_id)):
+                if key is not None:
+                    counts[key] = counts.get(key, 0) + 1
+            request.granted.set_result(budget)
+        for request in blocked:
+            heapq.heappush(self.queue, request)
+
+        while self.ponder_queue and self.running < self.slots and self.ponder_running < self.ponder_slots:
+            request = heapq.heappop(self.ponder_queue)
+            if request.granted.done():
+                continue
+            if loop.time() >= request.expires:
+                request.granted.set_exception(asyncio.TimeoutError())
+                continue
+            request.started = True
+            self.running += 1
+            self.ponder_running += 1
+            request.granted.set_result(request.budget)
+
+    def release(self, request):
+        self.running -= 1
+        if request.ponder:
+            self.ponder_running -= 1
+            self.pump()
+            return
+        for counts, key in ((self.guild_running, request.guild_id), (self.user_running, request.user_id)):
+            if key is not None:
+                counts[key] -= 1
+                if not counts[key]:
+                    del counts[key]
+        self.pump()
+
+    def queue_depth(self):
+        # Gauge collector for the metrics exporter
+        return {
+            ("ai_queue_depth", ()): len(self.queue),
+            ("ai_ponder_queue_depth", ()): len(self.ponder_queue),
+            ("ai_running", ()): self.running,
+            ("ai_pondering", ()): self.ponder_running,
+        }
+
+def get_ai_scheduler(client):
+    # Return the bot's AI scheduler, or a fallback around its AI service
+    return get_service(client, "ai_scheduler", lambda: AIScheduler(get_ai_service(client)))
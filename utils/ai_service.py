@@ -0,0 +1,83 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils.engines import run_cancellable, set_cancel_flags
+from utils.services import get_service
+
+# Cancellation flags shared with the worker processes, one per search in flight. Flags are handed
+# out round-robin, so there may be at most this many searches running or queued at once.
+CANCEL_FLAGS = 1024
+_cancel_flags = None
+_next_flag = itertools.count()
+
+def _start_worker(flags):
+    # Initializer of the worker processes
+    set_cancel_flags(flags)
+
+class AIService:
+    # Runs AI searches in a pool of worker processes so a long search never blocks the event loop
+    # that serves every shard. Search functions must be module-level and take picklable arguments.
+    # With workers=0 searches run in a pool of threads instead.
+
+    def __init__(self, workers=None):
+        global _cancel_flags
+        if _cancel_flags is None:
+            _cancel_flags = multiprocessing.get_context("spawn").RawArray("b", CANCEL_FLAGS)
+            # Searches run in threads of this process read the same flags
+            set_cancel_flags(_cancel_flags)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.executor = None
+        self.pending = set()
+
+    def start(self):
+        # Create the worker pool; processes are spawned lazily on the first submitted search
+        if self.executor is None:
+            if self.workers > 0:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_start_worker,
+                    initargs=(_cancel_flags,)
+                )
+            else:
+                self.executor = ThreadPoolExecutor(thread_name_prefix="ai-search")
+
+    def submit(self, fn, *args, on_stopped=None):
+        # Schedule fn(*args) and return an awaitable future for its result. Cancelling the future
+        # keeps a queued search from starting; one already running stops at the next check of its
+        # SearchBudget and its result is discarded. on_stopped, if given, is called in the event
+        # loop once the worker is done with the search.
+        loop = asyncio.get_running_loop()
+        self.start()
+        flag = next(_next_flag) % CANCEL_FLAGS
+        _cancel_flags[flag] = 0
+        search = self.executor.submit(run_cancellable, flag, fn, *args)
+        if on_stopped is not None:
+            def stopped(_):
+                try:
+                    loop.call_soon_threadsafe(on_stopped)
+                except RuntimeError:
+                    # The event loop was closed before the search ended
+                    pass
+            search.add_done_callback(stopped)
+        future = asyncio.wrap_future(search, loop=loop)
+        def cancel(_):
+            if future.cancelled():
+                _cancel_flags[flag] = 1
+        future.add_done_callback(cancel)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return future
+
+    def shutdown(self):
+        for future in list(self.pending):
+            future.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+def get_ai_service(client):
+    # Return the AI service started by the bot, or a thread-based fallback
+    return get_service(client, "ai_service", lambda: AIService(workers=0))
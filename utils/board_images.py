@@ -0,0 +1,153 @@
+import asyncio
+import io
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+from utils.metrics import metrics
+from utils.services import get_service
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+
+# Side of one board cell in pixels
+TILE_SIZE = 48
+# Number of encoded boards kept by the PNG cache
+CACHE_SIZE = 2048
+# Rendering one frame that missed the cache should stay under this many seconds; the benchmark
+# suite fails a render whose p99 is over it
+FRAME_BUDGET = 0.015
+
+BACKGROUND = (49, 51, 56)
+CONNECT4_BOARD = (29, 78, 216)
+CONNECT4_PIECES = {"red": (220, 38, 38), "yellow": (250, 204, 21), "hole": BACKGROUND}
+LABEL_COLOR = (219, 222, 225)
+LABELS = "ABCDEFGHI123456789"
+
+class TileAtlas:
+    # Every tile a board image can contain, decoded and drawn once into a single palette image.
+    # Tiles are cropped from it up front, so composing a board is only pastes of palette indices
+    # and the encoded PNG stays small.
+    __slots__ = ("palette", "tiles")
+
+    def __init__(self):
+        sources = {}
+        # Tic-Tac-Toe pieces from the bundled assets, centred on an empty cell
+        for name in ("cross", "circle", "dash"):
+            sources[f"ttt:{name}"] = self.centred(Image.open(os.path.join(ASSETS_DIR, f"{name}.png")).convert("RGBA"))
+        # Connect 4 cells: a disc or an empty hole in the blue frame
+        for name, color in CONNECT4_PIECES.items():
+            tile = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), CONNECT4_BOARD)
+            ImageDraw.Draw(tile).ellipse((4, 4, TILE_SIZE - 5, TILE_SIZE - 5), fill=color)
+            sources[f"c4:{name}"] = tile
+        # Marker above the column of the last Connect 4 move
+        arrow = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), BACKGROUND)
+        ImageDraw.Draw(arrow).polygon(
+            ((12, 16), (TILE_SIZE - 12, 16), (TILE_SIZE // 2, TILE_SIZE - 12)), fill=LABEL_COLOR
+        )
+        sources["arrow"] = arrow
+        # Row letters and column numbers
+        font = ImageFont.load_default(size=TILE_SIZE // 2)
+        for label in LABELS:
+            tile = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), BACKGROUND)
+            ImageDraw.Draw(tile).text((TILE_SIZE // 2, TILE_SIZE // 2), label, fill=LABEL_COLOR, font=font, anchor="mm")
+            sources[f"label:{label}"] = tile
+        sources["blank"] = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), BACKGROUND)
+
+        names = list(sources)
+        atlas = Image.new("RGB", (TILE_SIZE * len(names), TILE_SIZE), BACKGROUND)
+        for i, name in enumerate(names):
+            atlas.paste(sources[name], (i * TILE_SIZE, 0), sources[name])
+        atlas = atlas.quantize(colors=64)
+        self.palette = atlas.getpalette()
+        self.tiles = {name: atlas.crop((i * TILE_SIZE, 0, (i + 1) * TILE_SIZE, TILE_SIZE)) for i, name in enumerate(names)}
+
+    @staticmethod
+    def centred(image):
+        # Scale an asset to fit a cell with a margin and centre it on the background
+        tile = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), BACKGROUND + (255,))
+        image.thumbnail((TILE_SIZE - 8, TILE_SIZE - 8))
+        tile.paste(image, ((TILE_SIZE - image.width) // 2, (TILE_SIZE - image.height) // 2), image)
+        return tile
+
+    def compose(self, grid):
+        # Board image from rows of tile names, top row first
+        frame = Image.new("P", (TILE_SIZE * len(grid[0]), TILE_SIZE * len(grid)))
+        frame.putpalette(self.palette)
+        tiles = self.tiles
+        for y, row in enumerate(grid):
+            for x, name in enumerate(row):
+                frame.paste(tiles[name], (x * TILE_SIZE, y * TILE_SIZE))
+        return frame
+
+def encode_png(image):
+    # Fast zlib level: the palette frames are small whatever the level
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+class BoardRenderer:
+    # Board images for the game cogs. Encoded PNGs are kept in an LRU cache keyed by the
+    # position, so openings and repeated states are never encoded twice. Misses are composed and
+    # encoded on a small thread pool of its own, off the event loop and never queued behind AI
+    # searches.
+
+    def __init__(self, cache_size=CACHE_SIZE, workers=2):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # Key -> future of the renders still running
+        self.pending = {}
+        self.atlas = None
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="board-render")
+        self.hits = 0
+        self.misses = 0
+
+    def get_atlas(self):
+        # The atlas is built on first use, so bots that never render images skip the decoding
+        if self.atlas is None:
+            self.atlas = TileAtlas()
+        return self.atlas
+
+    def render_sync(self, grid):
+        return encode_png(self.get_atlas().compose(grid))
+
+    def render(self, key, grid):
+        # Future of the PNG bytes of the board described by grid, already resolved when key was
+        # rendered before. Callers stay synchronous, so a game's state never changes between its
+        # move and its render; the message editor awaits the future just before sending.
+        loop = asyncio.get_running_loop()
+        png = self.cache.get(key)
+        if png is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            metrics.inc("board_image_cache_total", result="hit")
+            future = loop.create_future()
+            future.set_result(png)
+            return future
+        future = self.pending.get(key)
+        if future is not None:
+            # Already being drawn for an earlier render of the same position
+            return future
+        self.misses += 1
+        metrics.inc("board_image_cache_total", result="miss")
+        start = loop.time()
+        future = self.pending[key] = loop.run_in_executor(self.executor, self.render_sync, grid)
+
+        def store(done):
+            # The cache is only touched on the event loop, so it needs no lock
+            del self.pending[key]
+            if done.cancelled() or done.exception() is not None:
+                return
+            metrics.observe("board_image_render_seconds", loop.time() - start)
+            self.cache[key] = done.result()
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        future.add_done_callback(store)
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Used by clients that were started without a renderer, e.g. when a cog is loaded on its own
+def get_board_renderer(client):
+    # Return the board renderer shared by the bot's cogs
+    return get_service(client, "board_renderer", BoardRenderer)
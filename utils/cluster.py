@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import sys
+from utils.metrics import metrics
+
+# Seconds between the stats reports each worker sends to the launcher
+STATS_INTERVAL = 5.0
+# Seconds a new worker gets to connect all of its shards before the launcher moves on
+READY_TIMEOUT = 120.0
+# Seconds a stopped worker gets to save its games and exit before it is killed
+STOP_TIMEOUT = 30.0
+# Delay before restarting a worker that died, doubled after each crash that came quickly
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+# A worker that ran this long before dying is considered healthy and restarts without backoff
+HEALTHY_UPTIME = 60.0
+
+# The launcher and its workers exchange one JSON object per line over a local TCP connection.
+# Workers send {"op": "hello", "cluster": id} once, then "ready" when all their shards are
+# connected and "stats" every STATS_INTERVAL seconds; the launcher answers every "stats" with
+# the cluster-wide "totals". The launcher tells a worker to "stop" when it restarts or shuts the
+# cluster down; rolling restarts are started by sending the launcher SIGHUP.
+
+def shard_ranges(shard_count, clusters):
+    # Split shards 0..shard_count-1 into `clusters` contiguous runs whose sizes differ by at most one
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for cluster_id in range(clusters):
+        end = start + size + (cluster_id < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+async def send(writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+async def connect_stand_in(shard_ids, shard_count, port, cluster_id=None):
+    # Identify each shard with a local stand-in gateway instead of Discord. Returns the writer of
+    # the connection; the shards stay online until it is closed.
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for shard_id in shard_ids:
+        await send(writer, {"op": "identify", "shard": shard_id, "shard_count": shard_count, "cluster": cluster_id})
+        message = json.loads(await reader.readline())
+        if message["op"] != "ready":
+            raise RuntimeError(f"Stand-in gateway rejected shard {shard_id}: {message.get('reason')}")
+    return writer
+
+class _Worker:
+    # Launcher-side record of one worker process
+    __slots__ = ("cluster_id", "shard_ids", "process", "writer", "ready", "stats", "stopping", "started", "crashes")
+
+    def __init__(self, cluster_id, shard_ids):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.writer = None
+        self.ready = asyncio.Event()
+        self.stats = {}
+        self.stopping = False
+        self.started = 0.0
+        self.crashes = 0
+
+class ClusterLauncher:
+    # Runs the bot's shards in `clusters` worker processes, each a full bot with its own cogs, AI
+    # service and saved games, so the shards are no longer limited to one core and one GIL.
+    # Workers are started one at a time, each once the previous one has all its shards connected,
+    # which keeps identifies within Discord's limits and is also how rolling restarts proceed.
+    # A worker that dies is restarted with the same shards after a backoff.
+
+    def __init__(self, shard_count, clusters, command=None, env=None):
+        self.shard_count = shard_count
+        self.command = command or [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")]
+        self.env = dict(os.environ if env is None else env)
+        self.workers = [_Worker(cluster_id, shard_ids) for cluster_id, shard_ids in enumerate(shard_ranges(shard_count, clusters))]
+        self.server = None
+        self.port = None
+        self.restart_lock = asyncio.Lock()
+        self.tasks = set()
+        self.closing = False
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        for worker in self.workers:
+            await self.spawn(worker)
+
+    async def spawn(self, worker):
+        # Start the worker's process and wait until it reports its shards ready
+        env = dict(self.env)
+        env.update({
+            "CLUSTER_ID": str(worker.cluster_id),
+            "SHARD_IDS": ",".join(map(str, worker.shard_ids)),
+            "SHARD_COUNT": str(self.shard_count),
+            "CLUSTER_IPC_PORT": str(self.port),
+        })
+        worker.ready.clear()
+        worker.stats = {}
+        worker.stopping = False
+        worker.started = asyncio.get_running_loop().time()
+        worker.process = await asyncio.create_subprocess_exec(*self.command, env=env)
+        print(f"Cluster {worker.cluster_id}: started pid {worker.process.pid} for shards {worker.shard_ids[0]}-{worker.shard_ids[-1]}")
+        self.watch(worker, worker.process)
+        try:
+            await asyncio.wait_for(worker.ready.wait(), READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Cluster {worker.cluster_id}: not ready after {READY_TIMEOUT:.0f}s, continuing")
+
+    def watch(self, worker, process):
+        # Restart the worker if its process exits without being asked to
+        async def wait():
+            code = await process.wait()
+            if worker.process is not process or worker.stopping or self.closing:
+                return
+            loop = asyncio.get_running_loop()
+            worker.crashes = 0 if loop.time() - worker.started > HEALTHY_UPTIME else worker.crashes + 1
+            delay = min(RESTART_DELAY * 2 ** max(worker.crashes - 1, 0), MAX_RESTART_DELAY)
+            print(f"Cluster {worker.cluster_id}: exited with code {code}, restarting in {delay:.0f}s")
+            metrics.inc("cluster_restarts_total", reason="crash")
+            await asyncio.sleep(delay)
+            if worker.process is process and not self.closing:
+                async with self.restart_lock:
+                    if worker.process is process:
+                        await self.spawn(worker)
+        task = asyncio.create_task(wait())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def stop_worker(self, worker):
+        # Ask the worker to save its games and exit, killing it if it does not in time
+        worker.stopping = True
+        process = worker.process
+        if process is None or process.returncode is not None:
+            return
+        if worker.writer is not None:
+            try:
+                await send(worker.writer, {"op": "stop"})
+            except ConnectionError:
+                pass
+        else:
+            process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Cluster {worker.cluster_id}: did not stop in time, killing it")
+            process.kill()
+            await process.wait()
+
+    async def rolling_restart(self):
+        # Restart the workers one at a time, so at most one cluster's shards are offline at once
+        async with self.restart_lock:
+            for worker in self.workers:
+                if self.closing:
+                    return
+                await self.stop_worker(worker)
+                metrics.inc("cluster_restarts_total", reason="rolling")
+                await self.spawn(worker)
+
+    async def close(self):
+        self.closing = True
+        await asyncio.gather(*(self.stop_worker(worker) for worker in self.workers))
+        for task in list(self.tasks):
+            task.cancel()
+        if self.server is not None:
+            self.server.close()
+
+    def totals(self):
+        # Cluster-wide sums of the latest stats reported by each worker
+        totals = {"clusters": len(self.workers), "clusters_ready": sum(worker.ready.is_set() for worker in self.workers)}
+        for worker in self.workers:
+            for name, value in worker.stats.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    async def handle(self, reader, writer):
+        # One worker's IPC connection
+        worker = None
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "hello":
+                    worker = self.workers[message["cluster"]]
+                    worker.writer = writer
+                elif worker is None:
+                    continue
+                elif op == "ready":
+                    worker.ready.set()
+                    print(f"Cluster {worker.cluster_id}: ready")
+                elif op == "stats":
+                    worker.stats = message["stats"]
+                    await send(writer, {"op": "totals", "totals": self.totals()})
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            if worker is not None and worker.writer is writer:
+                worker.writer = None
+            writer.close()
+
+class ClusterClient:
+    # Worker side of the IPC channel. Reports the worker's stats, keeps the latest cluster-wide
+    # totals for the metrics exporter and stops the bot when the launcher asks.
+
+    def __init__(self, cluster_id, port, collect, on_stop):
+        self.cluster_id = cluster_id
+        self.port = port
+        self.collect = collect
+        self.on_stop = on_stop
+        self.writer = None
+        self.totals = {}
+        self.tasks = []
+        self.stopping = None
+
+    async def start(self):
+        reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        await send(self.writer, {"op": "hello", "cluster": self.cluster_id})
+        self.tasks = [asyncio.create_task(self.listen(reader)), asyncio.create_task(self.report())]
+
+    async def ready(self):
+        await send(self.writer, {"op": "ready"})
+
+    async def report(self):
+        while True:
+            await send(self.writer, {"op": "stats", "stats": self.collect()})
+            await asyncio.sleep(STATS_INTERVAL)
+
+    async def listen(self, reader):
+        while line := await reader.readline():
+            message = json.loads(line)
+            if message.get("op") == "totals":
+                self.totals = message["totals"]
+            elif message.get("op") == "stop":
+                self.request_stop()
+                return
+        # The launcher is gone, so nobody would restart or stop this worker any more
+        print("Lost the cluster launcher, stopping")
+        self.request_stop()
+
+    def request_stop(self):
+        # on_stop runs in a task of its own: stopping the bot stops this client, which cancels
+        # the listen task it was requested from
+        if self.stopping is None:
+            self.stopping = asyncio.create_task(self.on_stop())
+
+    def cluster_stats(self):
+        # Gauge collector for the metrics exporter: the cluster-wide totals
+        return {(f"cluster_{name}", ()): value for name, value in self.totals.items()}
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,263 @@
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Common interface of the game AIs. An engine takes a position, the player to move and a
+# SearchBudget, and returns a SearchResult. Game-independent engines such as MCTSEngine learn
+# the game from a Rules object supplied by the cog.
+
+class SearchTimeout(Exception):
+    # Raised inside a search when its budget is used up
+    pass
+
+# Cancellation flags shared by the AI service with the processes and threads running its
+# searches, and the index of the flag of the search running in each thread. Budgets created
+# during that search stop it at their next clock check once the flag is set, so a cancelled search
+# frees its worker instead of running to the end of its budget.
+_cancel_flags = None
+_running = threading.local()
+
+def set_cancel_flags(flags):
+    global _cancel_flags
+    _cancel_flags = flags
+
+def run_cancellable(flag, fn, *args):
+    # Run fn(*args) in this thread as the search whose cancellation flag has index flag
+    _running.flag = flag
+    try:
+        return fn(*args)
+    finally:
+        _running.flag = None
+
+class SearchBudget:
+    # Limits of one search: seconds of wall-clock time, nodes visited and depth in plies, each
+    # None for no limit. The clock and the cancellation flag of the running search are only read
+    # each time the node count passes a multiple of 1024.
+    __slots__ = ("deadline", "max_nodes", "max_depth", "nodes", "cancel_flag")
+
+    def __init__(self, time_budget=None, node_budget=None, depth=None):
+        self.deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        self.max_nodes = node_budget
+        self.max_depth = depth
+        self.nodes = 0
+        self.cancel_flag = getattr(_running, "flag", None)
+
+    def tick(self, count=1):
+        # Count nodes visited, raising SearchTimeout once a limit is reached or the search was
+        # cancelled
+        before = self.nodes
+        self.nodes += count
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchTimeout()
+        if before >> 10 != self.nodes >> 10:
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+            if self.cancel_flag is not None and _cancel_flags[self.cancel_flag]:
+                raise SearchTimeout()
+
+class SearchResult:
+    # Outcome of one search: the move to play, its score in the engine's own units, the depth
+    # reached and the number of nodes visited
+    __slots__ = ("move", "score", "depth", "nodes")
+
+    def __init__(self, move, score=0, depth=0, nodes=0):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+
+class Engine:
+    # Base class of the AIs. Engines may keep state between the searches of a game.
+    name = None
+
+    def search(self, position, player, budget):
+        raise NotImplementedError
+
+    def reset(self):
+        # Forget anything kept from earlier searches
+        pass
+
+class Rules:
+    # Game rules as seen by a generic engine. Positions are mutable; the engine plays moves on
+    # copies it makes with copy().
+    def moves(self, position):
+        raise NotImplementedError
+
+    def play(self, position, move, player):
+        raise NotImplementedError
+
+    def won(self, position, move, player):
+        # Whether the player's move, just played, won the game; games with large boards only
+        # look at the lines through that move
+        raise NotImplementedError
+
+    def full(self, position):
+        raise NotImplementedError
+
+    def other(self, player):
+        raise NotImplementedError
+
+    def copy(self, position):
+        raise NotImplementedError
+
+    def key(self, position):
+        # Hashable identity of a position, used to find it again in a kept search tree
+        raise NotImplementedError
+
+    def rollout(self, position, player, rng, budget):
+        # Play random moves from position, player to move, until the game ends. Returns the
+        # winner, or None for a draw. Games override this with something faster or smarter.
+        while True:
+            moves = self.moves(position)
+            if not moves:
+                return None
+            budget.tick()
+            move = rng.choice(moves)
+            self.play(position, move, player)
+            if self.won(position, move, player):
+                return player
+            if self.full(position):
+                return None
+            player = self.other(player)
+
+class _Node:
+    # Node of the MCTS tree. wins counts, from the side of the player whose move led here,
+    # 1 per won and 0.5 per drawn playout through the node.
+    __slots__ = ("move", "player", "parent", "children", "untried", "visits", "wins", "terminal", "winner")
+
+    def __init__(self, move, player, parent):
+        self.move = move
+        self.player = player
+        self.parent = parent
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        self.wins = 0.0
+        self.terminal = False
+        self.winner = None
+
+class MCTSEngine(Engine):
+    # Anytime Monte Carlo Tree Search with UCT selection. It runs playouts until the budget
+    # is used up and plays the most visited move, so its strength scales with the time given.
+    # Trees of the latest searches are kept, and a search that starts from a position up to
+    # two plies below one of them continues from that subtree.
+    name = "mcts"
+
+    def __init__(self, rules, exploration=1.4, seed=None, keep_trees=16):
+        self.rules = rules
+        self.exploration = exploration
+        self.rng = random.Random(seed)
+        self.keep_trees = keep_trees
+        # Search root key -> {position key: node} of the positions within two plies of the root
+        self.trees = OrderedDict()
+
+    def reset(self):
+        self.trees.clear()
+
+    def search(self, position, player, budget):
+        if budget.deadline is None and budget.max_nodes is None:
+            raise ValueError("MCTS needs a time or node budget")
+        rules = self.rules
+        if not rules.moves(position):
+            return SearchResult(None, 0.5, 0, 0)
+        root = self.reuse(position, player)
+        if root.untried is None:
+            root.untried = list(reversed(rules.moves(position)))
+
+        depth = 0
+        try:
+            while True:
+                depth = max(depth, self.playout(root, position, budget))
+        except SearchTimeout:
+            pass
+
+        if not root.children:
+            # Not even one playout fitted in the budget
+            return SearchResult(rules.moves(position)[0], 0.5, 0, budget.nodes)
+        best = max(root.children, key=lambda child: child.visits)
+        self.keep(root, position)
+        return SearchResult(best.move, best.wins / best.visits, depth, budget.nodes)
+
+    def playout(self, root, position, budget):
+        # One iteration: select down the tree, expand a node, play out and back up the result.
+        # Returns the depth of the expanded node.
+        rules = self.rules
+        position = rules.copy(position)
+        node, depth = root, 0
+
+        # Select
+        while not node.untried and node.children:
+            log_visits = math.log(node.visits)
+            exploration = self.exploration
+            node = max(node.children, key=lambda child: child.wins / child.visits
+                       + exploration * math.sqrt(log_visits / child.visits))
+            budget.tick()
+            rules.play(position, node.move, node.player)
+            depth += 1
+
+        # Expand. The new node only joins the tree once its playout has finished, so a
+        # timeout part way leaves the tree as it was.
+        parent = node
+        if node.untried:
+            player = rules.other(node.player)
+            move = node.untried[-1]
+            budget.tick()
+            rules.play(position, move, player)
+            node = _Node(move, player, parent)
+            if rules.won(position, move, player):
+                node.terminal, node.winner = True, player
+            elif rules.full(position):
+                node.terminal = True
+            else:
+                node.untried = list(reversed(rules.moves(position)))
+            depth += 1
+
+        # Simulate
+        if node.terminal:
+            winner = node.winner
+        else:
+            winner = rules.rollout(position, rules.other(node.player), self.rng, budget)
+        if node is not parent:
+            parent.untried.pop()
+            parent.children.append(node)
+
+        # Back up
+        while node is not None:
+            node.visits += 1
+            if winner is None:
+                node.wins += 0.5
+            elif winner == node.player:
+                node.wins += 1
+            node = node.parent
+        return depth
+
+    def reuse(self, position, player):
+        # Subtree of a kept search tree for the position, or a new root
+        key = self.rules.key(position)
+        for root_key, nodes in self.trees.items():
+            node = nodes.get(key)
+            if node is not None and node.player != player:
+                del self.trees[root_key]
+                node.parent = None
+                return node
+        return _Node(None, self.rules.other(player), None)
+
+    def keep(self, root, position):
+        # Index the root and the positions after one and two plies for the next searches
+        rules = self.rules
+        nodes = {rules.key(position): root}
+        for child in root.children:
+            after_child = rules.copy(position)
+            rules.play(after_child, child.move, child.player)
+            nodes[rules.key(after_child)] = child
+            for grandchild in child.children:
+                after_grandchild = rules.copy(after_child)
+                rules.play(after_grandchild, grandchild.move, grandchild.player)
+                nodes[rules.key(after_grandchild)] = grandchild
+        root_key = rules.key(position)
+        self.trees.pop(root_key, None)
+        self.trees[root_key] = nodes
+        while len(self.trees) > self.keep_trees:
+            self.trees.popitem(last=False)
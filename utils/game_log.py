@@ -0,0 +1,234 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import metrics
+from utils.services import get_service
+
+# Finished games are appended to segment files as compact binary records: a fixed header
+# followed by one byte per move (the column in Connect 4, row * size + column in Tic-Tac-Toe).
+# Records are buffered and written in batches by a thread of the log's own, and a new segment is
+# started once the current one reaches SEGMENT_BYTES.
+
+SEGMENT_MAGIC = b"MGL1"
+# kind, variant, winner, flags, player 1 id, player 2 id, finished at (unix seconds), move count
+HEADER = struct.Struct("<BBBBQQIH")
+# Bytes per segment before the log rotates to a new one
+SEGMENT_BYTES = 4 * 1024 * 1024
+# Seconds between batched writes, and buffered bytes that trigger one sooner
+FLUSH_INTERVAL = 2.0
+FLUSH_BYTES = 64 * 1024
+# Players shown by the leaderboard of each game kind
+LEADERBOARD_SIZE = 10
+
+# Game kinds and their board variants, by the codes stored in the records. Codes are only ever
+# appended to, so old segments keep their meaning.
+KINDS = ("ttt", "c4")
+VARIANTS = {
+    "ttt": ("3x3", "5x5", "7x7", "9x9"),
+    "c4": ("7x6", "8x7", "9x7"),
+}
+# Winner codes
+FIRST_PLAYER = 0
+SECOND_PLAYER = 1
+DRAW = 2
+# Flags
+AI_GAME = 1
+FORFEIT = 2
+
+class PlayerStats:
+    __slots__ = ("wins", "losses", "draws", "reached")
+
+    def __init__(self):
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        # Order in which the player reached their current number of wins, breaking leaderboard ties
+        self.reached = 0
+
+    @property
+    def games(self):
+        return self.wins + self.losses + self.draws
+
+class GameIndex:
+    # In-memory aggregates of the log. Player stats are one dict lookup. Each kind's leaderboard
+    # keeps only its top LEADERBOARD_SIZE players: a player's ranking key, (wins, earliest to
+    # reach them), only ever increases, so a player outside the top can only enter it when one
+    # of their own games is recorded, and every update costs O(LEADERBOARD_SIZE).
+
+    def __init__(self):
+        self.players = {kind: {} for kind in KINDS}
+        self.leaders = {kind: [] for kind in KINDS}
+        self.games = {kind: 0 for kind in KINDS}
+        self.sequence = 0
+
+    def player(self, kind, user_id):
+        return self.players[kind].get(user_id)
+
+    def add(self, kind, winner, flags, player_ids):
+        self.games[kind] += 1
+        players = self.players[kind]
+        for seat, user_id in enumerate(player_ids):
+            if seat == SECOND_PLAYER and flags & AI_GAME:
+                # The bot itself is not ranked
+                continue
+            stats = players.get(user_id)
+            if stats is None:
+                stats = players[user_id] = PlayerStats()
+            if winner == DRAW:
+                stats.draws += 1
+            elif winner == seat:
+                stats.wins += 1
+                self.sequence += 1
+                stats.reached = self.sequence
+                self.promote(kind, user_id, stats)
+            else:
+                stats.losses += 1
+
+    def promote(self, kind, user_id, stats):
+        leaders = self.leaders[kind]
+        if user_id in leaders:
+            leaders.remove(user_id)
+        elif len(leaders) == LEADERBOARD_SIZE and self.rank_key(kind, leaders[-1]) >= (stats.wins, -stats.reached):
+            return
+        leaders.append(user_id)
+        leaders.sort(key=lambda leader: self.rank_key(kind, leader), reverse=True)
+        del leaders[LEADERBOARD_SIZE:]
+
+    def rank_key(self, kind, user_id):
+        stats = self.players[kind][user_id]
+        return stats.wins, -stats.reached
+
+    def leaderboard(self, kind):
+        # [(user id, stats)] of the top players, best first
+        return [(user_id, self.players[kind][user_id]) for user_id in self.leaders[kind]]
+
+def encode_record(kind, variant, winner, flags, player_ids, moves, finished_at=None):
+    header = HEADER.pack(
+        KINDS.index(kind), VARIANTS[kind].index(variant), winner, flags,
+        player_ids[0], player_ids[1], int(finished_at if finished_at is not None else time.time()), len(moves)
+    )
+    return header + bytes(moves)
+
+def iter_records(data):
+    # (kind, variant, winner, flags, player ids, finished at, moves) of every complete record in a
+    # segment's bytes; a record cut short by a crash ends the segment
+    offset = len(SEGMENT_MAGIC) if data[:len(SEGMENT_MAGIC)] == SEGMENT_MAGIC else len(data)
+    size = HEADER.size
+    while offset + size <= len(data):
+        kind, variant, winner, flags, player1, player2, finished_at, count = HEADER.unpack_from(data, offset)
+        end = offset + size + count
+        if end > len(data):
+            break
+        yield KINDS[kind], VARIANTS[KINDS[kind]][variant], winner, flags, (player1, player2), finished_at, data[offset + size:end]
+        offset = end
+
+class GameLog:
+    # Append-only history of finished games with the aggregate index behind /stats and
+    # /leaderboard. Recording a game only encodes it into a buffer and updates the index; the
+    # buffer is written off the event loop. On startup the index is rebuilt by scanning every
+    # segment through a read-only memory map.
+
+    def __init__(self, path=None, prefix="games"):
+        self.path = path
+        self.prefix = prefix
+        self.index = GameIndex()
+        self.buffer = bytearray()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="game-log")
+        self.task = None
+        self.flushing = None
+        self.segment = None
+        self.segment_size = 0
+        self.next_segment = 0
+
+    def open(self):
+        # Create the log directory and rebuild the index from the segments already in it
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self.load()
+
+    def segments(self):
+        # Paths of every segment in the log directory, including those of other cluster workers,
+        # oldest first for each writer
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(".log"))
+
+    def load(self):
+        start = time.perf_counter()
+        games = 0
+        for segment in self.segments():
+            with open(segment, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for kind, _, winner, flags, player_ids, _, _ in iter_records(data):
+                        self.index.add(kind, winner, flags, player_ids)
+                        games += 1
+            number = os.path.basename(segment)[len(self.prefix) + 1:-4]
+            if os.path.basename(segment).startswith(f"{self.prefix}-") and number.isdigit():
+                self.next_segment = max(self.next_segment, int(number) + 1)
+        print(f"Indexed {games} logged game(s) in {time.perf_counter() - start:.2f}s")
+
+    def record(self, kind, variant, winner, flags, player_ids, moves):
+        # Log a finished game; called on the event loop
+        self.index.add(kind, winner, flags, player_ids)
+        metrics.inc("games_logged_total", game=kind)
+        if self.path is None:
+            return
+        self.buffer += encode_record(kind, variant, winner, flags, player_ids, moves)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        if len(self.buffer) >= FLUSH_BYTES and self.flushing is None:
+            self.flush()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            if self.buffer and self.flushing is None:
+                self.flush()
+
+    def flush(self):
+        # Hand the buffered records to the writer thread
+        data, self.buffer = bytes(self.buffer), bytearray()
+        self.flushing = asyncio.get_running_loop().run_in_executor(self.executor, self.write, data)
+        self.flushing.add_done_callback(self.flushed)
+
+    def flushed(self, future):
+        self.flushing = None
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Failed to write the game log: {future.exception()}")
+
+    def write(self, data):
+        # Append to the current segment, starting a new one when it is full. Runs on the writer
+        # thread, or on the caller's thread from stop().
+        if self.segment is None or self.segment_size >= SEGMENT_BYTES:
+            if self.segment is not None:
+                self.segment.close()
+            path = os.path.join(self.path, f"{self.prefix}-{self.next_segment:06d}.log")
+            self.next_segment += 1
+            self.segment = open(path, "ab")
+            self.segment.write(SEGMENT_MAGIC)
+            self.segment_size = len(SEGMENT_MAGIC)
+        self.segment.write(data)
+        self.segment.flush()
+        self.segment_size += len(data)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        # Let a batch already handed to the writer finish, then write the rest in order
+        self.executor.shutdown(wait=True)
+        if self.buffer and self.path is not None:
+            self.write(bytes(self.buffer))
+            self.buffer = bytearray()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+# Used by clients that were started without a log, e.g. when a cog is loaded on its own; it
+# keeps the index in memory only
+def get_game_log(client):
+    # Return the game log shared by the bot's cogs
+    return get_service(client, "game_log", GameLog)
@@ -0,0 +1,149 @@
+import asyncio
+import io
+import discord
+from utils.metrics import metrics
+from utils.services import get_service
+
+async def attachment_files(attachments):
+    # Files to upload for a render's (filename, future of bytes) attachments. Files are consumed
+    # by the request that sends them, so a fresh set is made for every attempt.
+    files = []
+    for filename, data in attachments:
+        files.append(discord.File(io.BytesIO(await asyncio.shield(data)), filename=filename))
+    return files
+
+async def message_fields(fields):
+    # Keyword arguments of send_message for a render, which uploads attachments as files
+    if "attachments" not in fields:
+        return fields
+    fields = dict(fields)
+    fields["files"] = await attachment_files(fields.pop("attachments"))
+    return fields
+
+class _MessageQueue:
+    # Latest render waiting to be written to one game message
+    __slots__ = ("interaction", "fields", "not_before", "changed", "task")
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.fields = None
+        self.not_before = 0.0
+        self.changed = asyncio.Event()
+        self.task = None
+
+class MessageEditor:
+    # Coalescing edit pipeline for game messages, shared by the game cogs.
+    # Views submit the full render they want the message to show; only the newest render of a
+    # message is ever sent, so intermediate states that are superseded before delivery are dropped.
+    # The first edit after a button press doubles as the interaction acknowledgement, later ones
+    # go through edit_original_response and are spaced per channel to stay inside rate limits.
+
+    def __init__(self, min_interval=0.25):
+        self.min_interval = min_interval
+        self.queues = {}
+        self.buckets = {}
+        self.rest_calls = 0
+        self.coalesced = 0
+
+    def submit(self, interaction: discord.Interaction, hold=0.0, **fields):
+        # Queue a render of the interaction's message. With hold, delivery waits up to that many
+        # seconds for a newer render, e.g. the AI reply, so both moves go out in one edit.
+        loop = asyncio.get_running_loop()
+        key = interaction.message.id if interaction.message is not None else interaction.id
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = _MessageQueue(interaction)
+            queue.task = asyncio.create_task(self._run(key, queue))
+        elif queue.interaction is not interaction:
+            # Every interaction has to be acknowledged, even if its render is never sent
+            older = queue.interaction
+            if not older.response.is_done():
+                asyncio.create_task(self._acknowledge(older))
+            queue.interaction = interaction
+        if queue.fields is not None:
+            self.coalesced += 1
+        queue.fields = fields
+        queue.not_before = loop.time() + hold
+        queue.changed.set()
+
+    async def flush(self, interaction: discord.Interaction):
+        # Wait until every render queued for the interaction's message has been delivered
+        key = interaction.message.id if interaction.message is not None else interaction.id
+        queue = self.queues.get(key)
+        if queue is not None:
+            queue.not_before = 0.0
+            queue.changed.set()
+            await asyncio.shield(queue.task)
+
+    def _count_call(self, interaction):
+        # REST calls are labelled with the game kind taken from the pressed button's custom_id
+        self.rest_calls += 1
+        if metrics.enabled:
+            custom_id = (interaction.data or {}).get("custom_id", "")
+            metrics.inc("rest_calls_total", game=custom_id.partition(":")[0] or "other")
+
+    async def _acknowledge(self, interaction):
+        # Checked again as this runs as a task of its own, after an edit may have answered already
+        if interaction.response.is_done():
+            return
+        self._count_call(interaction)
+        try:
+            await interaction.response.defer()
+        except (discord.HTTPException, discord.InteractionResponded):
+            pass
+
+    async def _run(self, key, queue):
+        loop = asyncio.get_running_loop()
+        try:
+            while queue.fields is not None:
+                # Hold back until the caller's hold expires or a newer render replaces this one
+                queue.changed.clear()
+                delay = queue.not_before - loop.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(queue.changed.wait(), delay)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+
+                interaction = queue.interaction
+                acknowledged = interaction.response.is_done()
+                if acknowledged:
+                    # Follow-up edits share the channel's bucket; acknowledgements do not
+                    delay = self.buckets.get(interaction.channel_id, 0.0) - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        interaction = queue.interaction
+
+                fields, queue.fields = queue.fields, None
+                self._count_call(interaction)
+                try:
+                    sent = fields
+                    if "attachments" in fields:
+                        sent = dict(fields, attachments=await attachment_files(fields["attachments"]))
+                    if interaction.response.is_done():
+                        await interaction.edit_original_response(**sent)
+                    else:
+                        await interaction.response.edit_message(**sent)
+                    if metrics.enabled:
+                        # Time from the button press reaching Discord to the edit being applied
+                        latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+                        metrics.observe("interaction_latency_seconds", latency)
+                except discord.HTTPException as e:
+                    if e.status == 429:
+                        # Rate limited: back off and retry unless a newer render arrived meanwhile
+                        retry_after = getattr(e, "retry_after", None) or 1.0
+                        self.buckets[interaction.channel_id] = loop.time() + retry_after
+                        if queue.fields is None:
+                            queue.fields = fields
+                        continue
+                    print(f"Failed to edit game message: {e}")
+                self.buckets[interaction.channel_id] = loop.time() + self.min_interval
+        finally:
+            if self.queues.get(key) is queue:
+                del self.queues[key]
+
+# Used by clients that were started without an editor, e.g. when a cog is loaded on its own
+def get_message_editor(client):
+    # Return the message editor shared by the bot's cogs
+    return get_service(client, "message_editor", MessageEditor)
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import time
+
+# Default histogram buckets for durations in seconds and for searched node counts
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+NODE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+class Metrics:
+    # Process-wide counters, gauges and histograms for the bot's hot paths, exported in the
+    # Prometheus text format over a local HTTP endpoint and as periodic JSON log lines.
+    # Every recording method returns straight away while disabled, so call sites stay in place.
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.tasks = []
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def add_collector(self, collector):
+        # collector() is called on every export and returns {(name, labels tuple): value} gauges
+        self.collectors.append(collector)
+
+    def collect_gauges(self):
+        gauges = dict(self.gauges)
+        for collector in self.collectors:
+            gauges.update(collector())
+        return gauges
+
+    def render_prometheus(self):
+        lines = []
+        def series(name, labels, extra=()):
+            pairs = [*labels, *extra]
+            if not pairs:
+                return name
+            return name + "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{series(name, labels)} {value}")
+        for (name, labels), value in sorted(self.collect_gauges().items()):
+            lines.append(f"{series(name, labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{series(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{series(name + '_bucket', labels, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{series(name + '_sum', labels)} {histogram.sum}")
+            lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        # Flat dict of every series for structured log lines; histograms report count and mean
+        def key(name, labels):
+            return name + "".join(f"[{k}={v}]" for k, v in labels)
+
+        data = {key(name, labels): value for (name, labels), value in self.counters.items()}
+        data.update({key(name, labels): value for (name, labels), value in self.collect_gauges().items()})
+        for (name, labels), histogram in self.histograms.items():
+            data[key(name + "_count", labels)] = histogram.count
+            data[key(name + "_mean", labels)] = histogram.sum / histogram.count if histogram.count else 0.0
+        return data
+
+    async def handle_request(self, reader, writer):
+        # Minimal HTTP/1.0 responder: every request gets the metrics page
+        try:
+            await reader.readline()
+            body = self.render_prometheus().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def log_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(json.dumps({"event": "metrics", "time": time.time(), **self.snapshot()}))
+
+    async def monitor_loop_lag(self, interval=0.5):
+        # A sleep that wakes up late means the event loop was busy with something else
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = loop.time() - start - interval
+            self.set("event_loop_lag_seconds", lag)
+            self.observe("event_loop_lag_seconds_hist", lag)
+
+    async def start(self, port=None, log_interval=None, host="127.0.0.1"):
+        # Enable recording and start the exporters; call from inside the running event loop
+        self.enabled = True
+        self.tasks.append(asyncio.create_task(self.monitor_loop_lag()))
+        if log_interval:
+            self.tasks.append(asyncio.create_task(self.log_periodically(log_interval)))
+        if port:
+            server = await asyncio.start_server(self.handle_request, host, port)
+            print(f"Serving metrics on http://{host}:{port}/metrics")
+            self.tasks.append(asyncio.create_task(server.serve_forever()))
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.enabled = False
+
+# Shared by the bot and its cogs
+metrics = Metrics()
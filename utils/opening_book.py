@@ -0,0 +1,70 @@
+import mmap
+import os
+import struct
+
+# Opening books are files of fixed-size records sorted by key: each record is the position key as
+# a big-endian integer followed by the stored value, so comparing the raw key bytes orders records
+# like their keys and lookups binary search the file in place. The books are built offline (see
+# build_book.py) and memory-mapped read-only, so every process using one shares a single copy in
+# the page cache.
+
+BOOK_MAGIC = b"OBK1"
+# magic, book name, key bytes, value bytes, deepest ply stored, record count
+HEADER = struct.Struct("<4s16sBBHI")
+
+class OpeningBook:
+    __slots__ = ("path", "name", "key_bytes", "value_bytes", "max_ply", "count", "record_bytes", "file", "data")
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            self.file.close()
+            raise ValueError(f"{path} is not an opening book")
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+        magic, name, self.key_bytes, self.value_bytes, self.max_ply, self.count = HEADER.unpack_from(self.data)
+        self.name = name.rstrip(b"\0").decode()
+        self.record_bytes = self.key_bytes + self.value_bytes
+        if magic != BOOK_MAGIC or len(self.data) != HEADER.size + self.count * self.record_bytes:
+            self.close()
+            raise ValueError(f"{path} is not an opening book or is truncated")
+
+    def lookup(self, key):
+        # Value stored for key, or None when the book does not have the position
+        target = key.to_bytes(self.key_bytes, "big")
+        data, size, key_bytes = self.data, self.record_bytes, self.key_bytes
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * size
+            found = data[offset:offset + key_bytes]
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                return data[offset + key_bytes:offset + size]
+        return None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+def write_book(path, name, records, key_bytes, value_bytes, max_ply):
+    # Write {key: value bytes} as a book. The file is written next to path and renamed over it, so
+    # processes that have the old book mapped keep reading it until they reopen the path.
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(BOOK_MAGIC, name.encode(), key_bytes, value_bytes, max_ply, len(records)))
+        for key in sorted(records):
+            value = records[key]
+            if len(value) != value_bytes:
+                raise ValueError(f"book value of {value_bytes} bytes expected, got {len(value)}")
+            f.write(key.to_bytes(key_bytes, "big"))
+            f.write(value)
+    os.replace(temporary, path)
@@ -0,0 +1,16 @@
+import weakref
+
+# Services the bot creates once and shares between its cogs. Cogs look them up on the client, so
+# that a cog also works on a client started without them, e.g. when it is loaded on its own: such
+# a client gets fallback instances of its own, created on first use and dropped with the client.
+_fallbacks = weakref.WeakKeyDictionary()
+
+def get_service(client, name, factory):
+    # Return client.<name>, or the client's fallback built by factory() if it has none
+    service = getattr(client, name, None)
+    if service is None:
+        services = _fallbacks.setdefault(client, {})
+        service = services.get(name)
+        if service is None:
+            service = services[name] = factory()
+    return service
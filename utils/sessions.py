@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+import discord
+from utils.metrics import metrics
+from utils.services import get_service
+
+# Seconds without a button press before a game expires, as the old per-game views did
+SESSION_TIMEOUT = 300
+# Seconds between snapshots of the running games to disk
+SAVE_INTERVAL = 60
+
+class GameSession:
+    # Base record of one running game. Subclasses set KIND, the custom_id prefix routed to them,
+    # declare their own __slots__ and implement dispatch, expire, to_state and from_state.
+    KIND = None
+    __slots__ = ("game_id", "expires")
+
+    def custom_id(self, action):
+        # Button custom_id encoding the game and the pressed action
+        return f"{self.KIND}:{self.game_id}:{action}"
+
+    async def dispatch(self, interaction: discord.Interaction, action: str):
+        raise NotImplementedError
+
+    def expire(self):
+        # Called when the game times out; release anything still running for it
+        pass
+
+    def to_state(self):
+        # JSON-serialisable state used to restore the game after a restart
+        raise NotImplementedError
+
+    @classmethod
+    def from_state(cls, state):
+        raise NotImplementedError
+
+class TimerWheel:
+    # Hashed timing wheel with one slot per tick. Scheduling is O(1) and each tick only looks at
+    # the keys in its own slot, whatever the number of running games.
+    __slots__ = ("slots", "tick")
+
+    def __init__(self, size=512):
+        self.slots = [set() for _ in range(size)]
+        self.tick = 0
+
+    def schedule(self, key, tick):
+        # Deadlines further away than the wheel wraps around and are checked again when they come up
+        self.slots[max(tick, self.tick + 1) % len(self.slots)].add(key)
+
+    def advance(self):
+        # Move one tick forward and return the keys scheduled for it
+        self.tick += 1
+        index = self.tick % len(self.slots)
+        due, self.slots[index] = self.slots[index], set()
+        return due
+
+class SessionRegistry:
+    # Every running game of every cog, indexed by game id. A single on_interaction listener routes
+    # button presses, whose custom_id is "<kind>:<game id>:<action>", to the session; one timer
+    # wheel ticking once per second expires idle games. Running games are saved to disk so they
+    # keep working after a restart.
+
+    def __init__(self, path=None, timeout=SESSION_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.kinds = {}
+        self.sessions = {}
+        self.wheel = TimerWheel()
+        self.task = None
+        self.saved_states = self.load()
+
+    def register(self, session_cls):
+        # Route a session type's custom_ids to it and restore its games saved by the last run
+        self.kinds[session_cls.KIND] = session_cls
+        for game_id, remaining, state in self.saved_states.pop(session_cls.KIND, []):
+            session = session_cls.from_state(state)
+            session.game_id = game_id
+            self.add(session, remaining)
+
+    def new_id(self):
+        game_id = secrets.token_hex(6)
+        while game_id in self.sessions:
+            game_id = secrets.token_hex(6)
+        return game_id
+
+    def add(self, session, timeout=None):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        self.sessions[session.game_id] = session
+        session.expires = self.wheel.tick + (self.timeout if timeout is None else timeout)
+        self.wheel.schedule(session.game_id, session.expires)
+
+    def touch(self, session):
+        # Push the expiry back; the wheel entry is moved lazily when its old tick comes up
+        session.expires = self.wheel.tick + self.timeout
+
+    def remove(self, session):
+        if self.sessions.pop(session.game_id, None) is not None:
+            metrics.inc("games_finished_total", game=session.KIND)
+
+    def count(self, kind):
+        return sum(1 for session in self.sessions.values() if session.KIND == kind)
+
+    def active_games(self):
+        # Gauge collector for the metrics exporter: running games per kind
+        counts = {(("game", kind),): 0 for kind in self.kinds}
+        for session in self.sessions.values():
+            counts[(("game", session.KIND),)] = counts.get((("game", session.KIND),), 0) + 1
+        return {("active_games", labels): count for labels, count in counts.items()}
+
+    async def dispatch(self, interaction: discord.Interaction):
+        # on_interaction listener: hand registered component presses to their session
+        if interaction.type != discord.InteractionType.component:
+            return
+        custom_id = (interaction.data or {}).get("custom_id", "")
+        kind, _, rest = custom_id.partition(":")
+        if kind not in self.kinds:
+            return
+        game_id, _, action = rest.partition(":")
+        session = self.sessions.get(game_id)
+        if session is None:
+            await interaction.response.send_message("This game has ended.", ephemeral=True)
+            return
+        self.touch(session)
+        await session.dispatch(interaction, action)
+
+    async def run(self):
+        # Tick the wheel once per second, expiring idle games and saving snapshots
+        while True:
+            await asyncio.sleep(1)
+            for game_id in self.wheel.advance():
+                session = self.sessions.get(game_id)
+                if session is None:
+                    continue
+                if session.expires > self.wheel.tick:
+                    self.wheel.schedule(game_id, session.expires)
+                else:
+                    del self.sessions[game_id]
+                    metrics.inc("games_expired_total", game=session.KIND)
+                    session.expire()
+            if self.path is not None and self.wheel.tick % SAVE_INTERVAL == 0:
+                self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        games = {}
+        for session in self.sessions.values():
+            remaining = max(session.expires - self.wheel.tick, 1)
+            games.setdefault(session.KIND, []).append((session.game_id, remaining, session.to_state()))
+        # Games of cogs that were not loaded this run are kept for the next one
+        for kind, states in self.saved_states.items():
+            games.setdefault(kind, []).extend(states)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"saved_at": time.time(), "games": games}, f)
+        os.replace(temp_path, self.path)
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Failed to load saved games: {e}")
+            return {}
+        # Time spent offline counts against each game's timeout
+        elapsed = int(time.time() - data.get("saved_at", time.time()))
+        return {
+            kind: [(game_id, remaining - elapsed, state) for game_id, remaining, state in states if remaining > elapsed]
+            for kind, states in data.get("games", {}).items()
+        }
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.save()
+
+def get_session_registry(client):
+    # Return the session registry shared by the bot's cogs; a fallback registry is unsaved and
+    # routes the client's button presses itself
+    def create():
+        registry = SessionRegistry()
+        client.add_listener(registry.dispatch, "on_interaction")
+        return registry
+    return get_service(client, "sessions", create)